@@ -17,18 +17,31 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 import glob
+import hashlib
 import json
 import logging
 import re
 import os
+import shutil
 import subprocess
 import sys
+import tempfile
 import textwrap
 
 
 NAME = "add_project"
-__version__ = "0.2"
+__version__ = "0.3"
+# Maximum length of all paths in one git add command: stay well below the
+# command line limit of Windows (32767 characters)
+GIT_ADD_MAX_LENGTH = 30000
+MANIFEST = ".add_project.manifest"
+HASH_CHUNK_SIZE = 1024 * 1024
+REWRITE_CHUNK_SIZE = 1024 * 1024
+PROJECT_CACHE = ".add_project.cache"
+PARSE_CHUNK_SIZE = 64 * 1024
+SOURCE_BIN = re.compile(rb'"sourceBin"\s*:\s*')
 
 
 class LogFormatter(logging.Formatter):
@@ -60,6 +73,7 @@ class LogFilter(object):  # pylint: disable=too-few-public-methods
 
 def execute_command(cmd):
     """Executes command."""
+    stdout, stderr = "", b""
     try:
         process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         stdout, stderr = process.communicate()
@@ -68,29 +82,232 @@ def execute_command(cmd):
         result = -1
         logging.error("Could not execute %s: %s", cmd, exception.strerror)
     logging.debug(stdout)
+    if result and stderr:
+        logging.error(stderr.decode("utf-8", "replace").strip())
     return result == 0
 
 
-def git_add(filename):
-    execute_command(["git", "add", filename])
+def git_output(arguments):
+    """Return output of git command with arguments, or None when it failed."""
+    try:
+        process = subprocess.Popen(
+            ["git"] + arguments, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        stdout, stderr = process.communicate()
+    except OSError as exception:
+        logging.debug("Could not execute git: %s", exception.strerror)
+        return None
+    if process.returncode:
+        logging.debug(stderr.decode("utf-8", "replace").strip())
+        return None
+    return stdout
+
+
+def git_directory():
+    """Return the git directory of the current repository, or the current directory."""
+    output = git_output(["rev-parse", "--git-dir"])
+    return os.fsdecode(output).strip() if output else "."
+
+
+def staged_objects():
+    """Return dictionary of normalized path => object name of all files in the index."""
+    toplevel = git_output(["rev-parse", "--show-toplevel"])
+    listing = git_output(["ls-files", "--stage", "-z", "--full-name", "--", ":/"])
+    if toplevel is None or listing is None:
+        logging.error("Could not read the git index, staging all files")
+        return {}
+    toplevel = os.fsdecode(toplevel).strip()
+    objects = {}
+    for record in listing.split(b"\0"):
+        if record:
+            info, path = record.split(b"\t", 1)
+            path = os.path.join(toplevel, os.fsdecode(path))
+            objects[normalize(path)] = info.split()[1].decode("ascii")
+    return objects
+
+
+def batch_paths(paths, max_length=GIT_ADD_MAX_LENGTH):
+    """Split paths into batches with a total length of at most max_length."""
+    batches, batch, length = [], [], 0
+    for path in paths:
+        if batch and length + len(path) + 1 > max_length:
+            batches.append(batch)
+            batch, length = [], 0
+        batch.append(path)
+        length += len(path) + 1
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def git_add(filenames, dry_run=False):
+    """Stage filenames, using as few git add commands as possible.
+
+    Returns the filenames that were staged, leaving out batches that failed.
+    """
+    batches = batch_paths(filenames)
+    staged = []
+    for number, batch in enumerate(batches, 1):
+        logging.info("Batch %d/%d: staging %d files", number, len(batches), len(batch))
+        for filename in batch:
+            logging.debug("  %s", filename)
+        if dry_run or execute_command(["git", "add", "--"] + batch):
+            staged.extend(batch)
+        else:
+            logging.error("Could not stage batch %d/%d", number, len(batches))
+    return staged
+
+
+def hash_file(filename):
+    """Return SHA-256 hash of filename, reading it in chunks."""
+    digest = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(filename):
+    """Load manifest (or cache) of path => size, mtime and hash (or sources)."""
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(filename, manifest):
+    """Save manifest (or cache)."""
+    with open(filename + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=0, sort_keys=True)
+    os.replace(filename + ".tmp", filename)
+
+
+def manifest_entry(path, previous):
+    """Return manifest entry of path, only hashing the file when size or mtime changed."""
+    stat = os.stat(path)
+    entry = {"size": stat.st_size, "mtime": stat.st_mtime}
+    if (
+        previous
+        and previous["size"] == entry["size"]
+        and previous["mtime"] == entry["mtime"]
+    ):
+        entry["hash"] = previous["hash"]
+    else:
+        entry["hash"] = hash_file(path)
+    return entry
+
+
+def changed_paths(paths, manifest, jobs, objects):
+    """Return paths that changed according to the manifest, the skipped number of bytes
+    and the new manifest entries of the changed paths.
+
+    A path is only unchanged when its hash is the same as when it was staged, and
+    git's index (objects) still holds the object it was staged as. The manifest
+    is updated with the current entries of all unchanged paths, entries of
+    changed paths should only be recorded once they are staged.
+    """
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        entries = list(
+            pool.map(lambda path: manifest_entry(path, manifest.get(path)), paths)
+        )
+    changed, skipped, pending = [], 0, {}
+    for path, entry in zip(paths, entries):
+        previous = manifest.get(path)
+        if (
+            previous
+            and previous["hash"] == entry["hash"]
+            and previous.get("object")
+            and objects.get(normalize(path)) == previous["object"]
+        ):
+            entry["object"] = previous["object"]
+            skipped += entry["size"]
+            manifest[path] = entry
+        else:
+            changed.append(path)
+            pending[path] = entry
+    return changed, skipped, pending
+
+
+def relative_replacement():
+    """Return replacement of the current (absolute) path with a relative path."""
+    return os.getcwd().replace("/", r"\\") + r"\\", ""
 
 
 def make_relative(filename):
     """Replace absolute paths with relative paths."""
-    current = os.getcwd().replace("/", r"\\") + r"\\"
-    rewrite_file(filename, current, "")
-
-
-def rewrite_file(filename, old, new):
-    """Change string in file from old to new."""
-    with open(filename) as f:
-        buffer = f.read()
-
-    if buffer.lower().find(old.lower()):
-        replacer = re.compile(re.escape(old), re.IGNORECASE)
-        logging.info("Replacing %s with %s in %s", old, new, filename)
-        with open(filename, "w") as f:
-            f.write(replacer.sub(new, buffer))
+    return rewrite_file(filename, [relative_replacement()])
+
+
+def contains(filename, pattern, keep):
+    """Return whether pattern occurs in filename, reading it in chunks.
+
+    The last keep bytes of each chunk are searched again with the next chunk.
+    """
+    with open(filename, "rb") as source:
+        pending = b""
+        while True:
+            chunk = source.read(REWRITE_CHUNK_SIZE)
+            buffer = pending + chunk
+            if pattern.search(buffer):
+                return True
+            if not chunk:
+                return False
+            pending = buffer[len(buffer) - keep :]
+
+
+def rewrite_file(filename, replacements):
+    """Apply all (old, new) replacements case-insensitively, in one streaming pass.
+
+    The file is first scanned, and only when something matches it is read in
+    chunks and written to a temporary file, which then replaces the original
+    file. Returns the number of replacements.
+    """
+    replacements = [
+        (old.encode("utf-8"), new.encode("utf-8")) for old, new in replacements if old
+    ]
+    if not replacements:
+        return 0
+    lookup = dict((old.lower(), new) for old, new in replacements)
+    pattern = re.compile(
+        b"|".join(re.escape(old) for old in sorted(lookup, key=len, reverse=True)),
+        re.IGNORECASE,
+    )
+    keep = max(len(old) for old in lookup) - 1
+    if not contains(filename, pattern, keep):
+        return 0
+    handle, temporary = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)))
+    count = 0
+    try:
+        with open(filename, "rb") as source, os.fdopen(handle, "wb") as destination:
+            pending = b""
+            while True:
+                chunk = source.read(REWRITE_CHUNK_SIZE)
+                buffer = pending + chunk
+                # Matches starting before limit are complete, the rest is kept
+                limit = len(buffer) - keep if chunk else len(buffer)
+                position = 0
+                for match in pattern.finditer(buffer):
+                    if match.start() >= limit:
+                        break
+                    destination.write(buffer[position : match.start()])
+                    destination.write(lookup[match.group(0).lower()])
+                    position = match.end()
+                    count += 1
+                if position < limit:
+                    destination.write(buffer[position:limit])
+                    position = limit
+                pending = buffer[position:]
+                if not chunk:
+                    break
+        if count:
+            shutil.copymode(filename, temporary)
+            os.replace(temporary, filename)
+            logging.info("Replaced %d occurrences in %s", count, filename)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+    return count
 
 
 def parse_arguments(banner):
@@ -125,6 +342,37 @@ def parse_arguments(banner):
     parser.add_argument(
         "--new", type=str, help="New path to replace current path with in project file"
     )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="Only show which files would be staged"
+    )
+    parser.add_argument(
+        "--uses", type=str, help="Show which projects use the specified file and exit"
+    )
+    parser.add_argument(
+        "--unreferenced",
+        type=str,
+        metavar="DIRECTORY",
+        help="Show files in DIRECTORY that are not used by any project and exit",
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="Stage all files, even unchanged ones"
+    )
+    parser.add_argument(
+        "--manifest",
+        type=str,
+        help=f"Manifest of staged files (default {MANIFEST} in the git directory)",
+    )
+    parser.add_argument(
+        "--cache",
+        type=str,
+        help=f"Cache of parsed projects (default {PROJECT_CACHE} in the git directory)",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of projects to parse concurrently (default %(default)s)",
+    )
     parser.add_argument("-v", "--verbose", action="store_true", help="Be more verbose")
     args = parser.parse_args()
     if args.version:
@@ -151,30 +399,153 @@ def setup_logging(args):
     logger.addHandler(errors)
 
 
-def parse_project(project, args):
-    """Parse a project file."""
+def state_file(path, directory, name, dry_run):
+    """Return path of a state file, by default name in directory.
+
+    A state file that an earlier version left in the current directory is moved
+    there, so that it doesn't show up as untracked file.
+    """
+    if path:
+        return path
+    path = os.path.join(directory, name)
+    if not dry_run and os.path.isfile(name) and not os.path.exists(path):
+        os.replace(name, path)
+    return path
+
+
+def read_sources(project):
+    """Return the sources of the sourceBin of a project, without parsing the whole file.
+
+    The file is searched in fixed-size chunks for the sourceBin key, and read in
+    growing chunks from there up to the end of the sourceBin array. Only that
+    array is decoded, and the timeline that usually follows it is never read.
+    """
+    decoder = json.JSONDecoder()
+    size = PARSE_CHUNK_SIZE
+    buffer = b""
+    found = False
+    with open(project, "rb") as f:
+        while True:
+            chunk = f.read(size)
+            if found:
+                size *= 2
+            buffer += chunk
+            if not found:
+                match = SOURCE_BIN.search(buffer)
+                if not match:
+                    if not chunk:
+                        return []
+                    buffer = buffer[-64:]  # The key might be split over chunks
+                    continue
+                buffer = buffer[match.end() :]
+                found = True
+            try:
+                source_bin, _ = decoder.raw_decode(buffer.decode("utf-8").lstrip())
+                return [src["src"] for src in source_bin]
+            except ValueError:  # Incomplete array, or split UTF-8 character
+                if not chunk:
+                    raise
+
+
+def parse_project(project, args, cache):
+    """Parse a project file, and return its size, mtime and the sources it uses.
+
+    Projects that did not change since they were cached are not parsed again.
+    """
     if not os.path.isfile(project):
-        return
+        return None
+    replacements = []
     if args.relative:
-        make_relative(project)
+        replacements.append(relative_replacement())
     if args.fix:
-        rewrite_file(project, args.fix, "")
-    git_add(project)
-    parsed = json.load(open(project))
-    if "sourceBin" in parsed:
-        sources = parsed["sourceBin"]
-        logging.info("%s uses the following resources:", project)
-        for src in sources:
-            source = src["src"]
+        replacements.append((args.fix, ""))
+    if not args.dry_run:
+        rewrite_file(project, replacements)
+    stat = os.stat(project)
+    entry = {"size": stat.st_size, "mtime": stat.st_mtime}
+    cached = cache.get(project)
+    if cached and cached["size"] == entry["size"] and cached["mtime"] == entry["mtime"]:
+        entry["sources"] = cached["sources"]
+    else:
+        try:
+            entry["sources"] = read_sources(project)
+        except (KeyError, TypeError, ValueError) as exception:
+            logging.error("Could not parse %s: %s", project, exception)
+            return None
+    return entry
+
+
+def normalize(path):
+    """Return normalized absolute path, to compare paths used by different projects."""
+    return os.path.normcase(os.path.abspath(path))
+
+
+def update_index(projects, args):
+    """Parse projects concurrently, and return the updated project index.
+
+    The index maps each project to its size, mtime and the sources it uses, and
+    is persisted, so that only changed projects need to be parsed again.
+    """
+    index = load_manifest(args.cache)
+    for project in list(index):
+        if not os.path.isfile(project):
+            del index[project]
+    with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+        entries = list(
+            pool.map(lambda project: parse_project(project, args, index), projects)
+        )
+    for project, entry in zip(projects, entries):
+        if entry:
+            index[project] = entry
+    if not args.dry_run:
+        save_manifest(args.cache, index)
+    return index
+
+
+def asset_index(index):
+    """Return dictionary of normalized asset path => (asset, projects that use it)."""
+    assets = {}
+    for project, entry in index.items():
+        for source in entry["sources"]:
             if "ProgramData" not in source:
-                logging.info("Adding %s", source)
-                # if args["current"] and args["new"] and args["current"] in source:
-                #     source = source.replace(args["current"], args["new"])
-                #     print(f"replacing to {source}"
-                if not os.path.isfile(source):
-                    log.error("WARNING: %s cannot be found", source)
-                    sys.exit(-1)
-                git_add(source)
+                assets.setdefault(normalize(source), (source, set()))[1].add(project)
+    return assets
+
+
+def projects_using(index, asset):
+    """Return sorted list of projects that use asset."""
+    return sorted(asset_index(index).get(normalize(asset), (asset, set()))[1])
+
+
+def unreferenced_assets(index, directory):
+    """Return sorted list of files in directory that are not used by any project."""
+    assets = asset_index(index)
+    unreferenced = []
+    for root, directories, files in os.walk(directory):
+        directories[:] = [name for name in directories if not name.startswith(".")]
+        for name in files:
+            path = os.path.join(root, name)
+            if not (name.startswith(".") or name.endswith(".tscproj")) and (
+                normalize(path) not in assets
+            ):
+                unreferenced.append(path)
+    return sorted(unreferenced)
+
+
+def collect_paths(projects, index):
+    """Return all unique paths to stage, and the assets that cannot be found."""
+    assets = asset_index(
+        dict((project, index[project]) for project in projects if project in index)
+    )
+    paths = [project for project in projects if project in index]
+    missing = []
+    for asset, users in assets.values():
+        logging.debug("%s is used by %s", asset, ", ".join(sorted(users)))
+        if os.path.isfile(asset):
+            paths.append(asset)
+        else:
+            missing.append((asset, users))
+    return paths, missing
 
 
 def main():
@@ -182,15 +553,50 @@ def main():
     banner = f"{NAME} version {__version__}"
     args = parse_arguments(banner)
     setup_logging(args)
+    directory = git_directory()
+    args.manifest = state_file(args.manifest, directory, MANIFEST, args.dry_run)
+    args.cache = state_file(args.cache, directory, PROJECT_CACHE, args.dry_run)
     if args.input:
         if args.relative:
-            make_relative(args.input)
+            if not args.dry_run:
+                make_relative(args.input)
             sys.exit(0)
-        projects = [parse_project(args.input)]
+        projects = [args.input]
     else:
         projects = glob.glob(os.path.join("./m?/*.tscproj"))
-    for project in projects:
-        parse_project(project, args)
+    index = update_index(projects, args)
+    if args.uses:
+        print("\n".join(projects_using(index, args.uses)))
+        sys.exit(0)
+    if args.unreferenced:
+        print("\n".join(unreferenced_assets(index, args.unreferenced)))
+        sys.exit(0)
+    paths, missing = collect_paths(projects, index)
+    for path, users in missing:
+        logging.error(
+            "WARNING: %s cannot be found (used by %s)", path, ", ".join(sorted(users))
+        )
+    if missing:
+        sys.exit(-1)
+    manifest = {} if args.force else load_manifest(args.manifest)
+    changed, skipped, pending = changed_paths(
+        paths, manifest, args.jobs, staged_objects()
+    )
+    logging.info(
+        "Skipping %d unchanged files (%d bytes)", len(paths) - len(changed), skipped
+    )
+    logging.info("Staging %d files from %d projects", len(changed), len(projects))
+    staged = git_add(changed, args.dry_run)
+    if not args.dry_run:
+        objects = staged_objects() if staged else {}
+        for path in staged:
+            if normalize(path) in objects:
+                pending[path]["object"] = objects[normalize(path)]
+                manifest[path] = pending[path]
+        save_manifest(args.manifest, manifest)
+    if len(staged) < len(changed):
+        logging.error("Could not stage %d files", len(changed) - len(staged))
+        sys.exit(-1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""benchmark - Measure throughput of the hot paths of convert_currency and worldtimes
+
+Copyright (C) 2017-2018 Peter Mosmans [Go Forward]
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+"""
+
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+from datetime import datetime, timedelta
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import textwrap
+import timeit
+
+VERSION = '0.1'
+COLD_STARTS = [('cold_start_convert_currency', ['convert_currency.py', '--help']),
+               ('cold_start_worldtimes', ['worldtimes.py', '--help']),
+               ('cold_start_worldtimes_list', ['worldtimes.py', '--list']),
+               ('import_worldtimes', ['-c', 'import worldtimes'])]
+
+
+class FakeRates(object):  # pylint: disable=too-few-public-methods
+    """Stand-in for AsyncRateFetcher that never touches the network."""
+
+    CURRENCIES = ['AUD', 'CAD', 'CHF', 'GBP', 'JPY', 'MYR', 'SGD', 'USD']
+
+    def __init__(self):
+        self.calls = 0
+
+    def get_rates(self, base, date):  # pylint: disable=unused-argument
+        """Return a fixed rate table for @base."""
+        self.calls += 1
+        return dict((currency, 1.0 + index / 10.0)
+                    for index, currency in enumerate(self.CURRENCIES) if currency != base)
+
+
+def measure(name, statement, number, repeat):
+    """Time @statement @repeat times @number calls and return the result record."""
+    timings = timeit.repeat(statement, number=number, repeat=repeat)
+    best = min(timings)
+    return {'name': name,
+            'number': number,
+            'repeat': repeat,
+            'best': best,
+            'mean': sum(timings) / len(timings),
+            'per_call': best / number,
+            'calls_per_second': number / best if best else None}
+
+
+def bench_convert_currency(size, repeat):
+    """Yield benchmark records for convert_currency."""
+    import convert_currency
+    amounts = [random.uniform(0, 100000) for _ in range(size)]
+    yield measure('calculate_fees', lambda: [convert_currency.calculate_fees(amount, 102.5, 2)
+                                             for amount in amounts], 1, repeat)
+    yield measure('calculate_fees_array',
+                  lambda: convert_currency.calculate_fees_array(amounts, 102.5, 2), 1, repeat)
+    date = datetime(2018, 2, 18)
+    cross_rates = convert_currency.CrossRates(FakeRates(), None)
+    yield measure('rate_lookup_warm',
+                  lambda: cross_rates.get_rate('USD', 'GBP', date), size, repeat)
+    dates = [date - timedelta(days=day) for day in range(size)]
+
+    def cold_lookups():
+        """Look up rates for many different dates on a cold CrossRates."""
+        rates = convert_currency.CrossRates(FakeRates(), None)
+        for day in dates:
+            rates.get_rate('USD', 'GBP', day)
+    yield measure('rate_lookup_cold', cold_lookups, 1, repeat)
+
+
+def bench_worldtimes(size, repeat):
+    """Yield benchmark records for worldtimes."""
+    import pytz
+    import worldtimes
+    zones = sorted(pytz.common_timezones)[:size]
+    utc = pytz.timezone('UTC')
+    instants = [utc.localize(datetime(2018, 1, 1) + timedelta(hours=7 * index))
+                for index in range(size)]
+    yield measure('sort_times', lambda: worldtimes.sort_times(list(zones), instants[0], []),
+                  10, repeat)
+    yield measure('sort_times_instants',
+                  lambda: [worldtimes.sort_times(list(zones[:20]), instant, [])
+                           for instant in instants], 1, repeat)
+    yield measure('set_datetime',
+                  lambda: [worldtimes.set_datetime('13:37', '2018-02-18', utc)
+                           for _ in range(size)], 1, repeat)
+
+
+def bench_cold_start(repeat):
+    """Yield benchmark records for starting each script and importing worldtimes."""
+    path = os.path.dirname(os.path.abspath(__file__))
+    for name, arguments in COLD_STARTS:
+        command = [sys.executable] + arguments
+        yield measure(name, lambda: subprocess.call(command, cwd=path,
+                                                    stdout=subprocess.DEVNULL,
+                                                    stderr=subprocess.DEVNULL), 1, repeat)
+
+
+def compare(results, previous):
+    """Print relative difference of @results against @previous results."""
+    before = dict((record['name'], record) for record in previous['results'])
+    for record in results:
+        if record['name'] in before:
+            ratio = record['per_call'] / before[record['name']]['per_call']
+            print('{0:28} {1:>8.2f}x {2}'.format(record['name'], ratio,
+                                                 'slower' if ratio > 1 else 'faster'))
+
+
+def parse_arguments(banner):
+    """Parse and return command line arguments."""
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent(banner + '''\
+ - Measure throughput of the hot paths of convert_currency and worldtimes
+
+Copyright (C) 2017-2018 Peter Mosmans [Go Forward]
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.'''))
+    parser.add_argument('--size', action='store', type=int, default=500,
+                        help='Number of amounts, dates, zones and instants '
+                        '(default %(default)s)')
+    parser.add_argument('--repeat', action='store', type=int, default=5,
+                        help='Number of repetitions (default %(default)s)')
+    parser.add_argument('--only', action='store', choices=['convert_currency', 'worldtimes',
+                                                           'cold_start'],
+                        help='Only run this group of benchmarks')
+    parser.add_argument('--output', action='store',
+                        help='Write results as JSON to file')
+    parser.add_argument('--compare', action='store',
+                        help='Compare results with earlier JSON results')
+    return vars(parser.parse_args())
+
+
+def main():
+    """Main program loop."""
+    banner = 'benchmark version {0}'.format(VERSION)
+    options = parse_arguments(banner)
+    random.seed(0)
+    groups = [('convert_currency', lambda: bench_convert_currency(options['size'],
+                                                                  options['repeat'])),
+              ('worldtimes', lambda: bench_worldtimes(options['size'], options['repeat'])),
+              ('cold_start', lambda: bench_cold_start(options['repeat']))]
+    results = []
+    for group, benchmarks in groups:
+        if options['only'] and options['only'] != group:
+            continue
+        for record in benchmarks():
+            record['group'] = group
+            results.append(record)
+            print('{0:28} {1:>14.3f} us/call {2:>14.1f} calls/s'.
+                  format(record['name'], record['per_call'] * 1e6,
+                         record['calls_per_second'] or 0))
+    report = {'version': VERSION,
+              'timestamp': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+              'python': platform.python_version(),
+              'platform': platform.platform(),
+              'size': options['size'],
+              'results': results}
+    if options['output']:
+        with open(options['output'], 'w') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+    if options['compare']:
+        with open(options['compare']) as previous:
+            compare(results, json.load(previous))
+
+
+if __name__ == "__main__":
+    main()
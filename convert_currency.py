@@ -17,20 +17,625 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import argparse
-from datetime import datetime
+import csv
+from datetime import datetime, timedelta
+import json
+import mmap
+import os
+import socket
+import socketserver
+import struct
 import sys
 import textwrap
+import threading
+import time
+import urllib.parse
 
-try:
-    from forex_python.converter import CurrencyRates, RatesNotAvailableError
-except ImportError as exception:
-    print('This script needs external pip libraries: {0}'.format(exception),
-          file=sys.stderr)
-    print('Install the missing libraries using pip -r requirements.txt',
-          file=sys.stderr)
-    sys.exit(-1)
+VERSION = '0.6'
+CACHE_FILE = os.path.join(os.path.expanduser('~'), '.convert_currency.sqlite')
+CACHE_TTL = 3600  # Seconds that rates of today are considered valid
+BASE_CURRENCY = 'EUR'
+RATES_URL = 'https://theratesapi.com/api/'
+SNAPSHOT_MAGIC = b'CCRS'
+SNAPSHOT_VERSION = 1
+# magic, version, base currency, number of dates, number of currencies
+SNAPSHOT_HEADER = struct.Struct('<4sH3sxII')
+BATCH_FIELDS = ['amount', 'from', 'to', 'date', 'rate', 'minus_fee', 'total', 'plus_fee']
 
-VERSION = '0.5'
+
+class RatesNotAvailableError(Exception):
+    """Raised when rates can't be retrieved from the provider, cache or snapshot."""
+
+
+class RateCache(object):
+    """Persistent store of rate tables, keyed by base currency and date.
+
+    Rates fetched after their date has ended never change and are kept
+    forever. Rates fetched earlier (on the day itself, when the provider might
+    still return the rates of the previous business day) expire after @ttl
+    seconds.
+    """
+
+    def __init__(self, filename=CACHE_FILE, ttl=CACHE_TTL):
+        import sqlite3  # pylint: disable=import-outside-toplevel
+        self.ttl = ttl
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS rates '
+                                '(base TEXT, date TEXT, rates TEXT, fetched REAL, '
+                                'PRIMARY KEY (base, date))')
+
+    def get(self, base, date):
+        """Return cached rate table for @base on @date, or None."""
+        row = self.connection.execute('SELECT rates, fetched FROM rates WHERE '
+                                      'base = ? AND date = ?',
+                                      (base, date_key(date))).fetchone()
+        if not row:
+            return None
+        if row[1] < end_of_day(date) and time.time() - row[1] > self.ttl:
+            return None
+        return json.loads(row[0])
+
+    def store(self, base, date, table):
+        """Store rate table for @base on @date."""
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO rates VALUES (?, ?, ?, ?)',
+                                    (base, date_key(date), json.dumps(table),
+                                     time.time()))
+
+    def tables(self, base):
+        """Yield all cached (date, rate table) tuples for @base, sorted on date."""
+        for date, table in self.connection.execute('SELECT date, rates FROM rates WHERE '
+                                                   'base = ? ORDER BY date', (base,)):
+            yield datetime.strptime(date, '%Y-%m-%d'), json.loads(table)
+
+    def close(self):
+        """Close the underlying database."""
+        self.connection.close()
+
+
+class RateSnapshot(object):
+    """Read-only lookup of rates in a memory-mapped snapshot file.
+
+    The file consists of a header, the sorted currency codes, a sorted index of
+    dates (as ordinals) and per currency an array of rates (one per date, NaN
+    when not available). All numbers are little-endian. A rate is found by a
+    binary search on the date index, without parsing the rest of the file.
+    Offers the same get_rates interface as AsyncRateFetcher.
+    """
+
+    def __init__(self, filename):
+        with open(filename, 'rb') as snapshot:
+            self.data = mmap.mmap(snapshot.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, base, self.dates, count = SNAPSHOT_HEADER.unpack_from(self.data)
+        except struct.error:
+            raise ValueError('{0} is not a rate snapshot'.format(filename))
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError('{0} is not a version {1} rate snapshot'.
+                             format(filename, SNAPSHOT_VERSION))
+        self.base = base.decode('ascii')
+        offset = SNAPSHOT_HEADER.size
+        codes = self.data[offset:offset + 3 * count].decode('ascii')
+        self.currencies = dict((codes[index * 3:index * 3 + 3], index)
+                               for index in range(count))
+        self.index_offset = snapshot_padding(offset + 3 * count)
+        self.rates_offset = self.index_offset + 4 * self.dates
+
+    def find_date(self, date):
+        """Return position of @date in the date index, or None."""
+        ordinal = date.toordinal()
+        low, high = 0, self.dates
+        while low < high:
+            middle = (low + high) // 2
+            if struct.unpack_from('<i', self.data, self.index_offset + 4 * middle)[0] < ordinal:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.dates and \
+           struct.unpack_from('<i', self.data, self.index_offset + 4 * low)[0] == ordinal:
+            return low
+        return None
+
+    def rate(self, currency, position):
+        """Return rate of @currency at @position in the date index, or None."""
+        offset = self.rates_offset + 8 * (self.currencies[currency] * self.dates + position)
+        value = struct.unpack_from('<d', self.data, offset)[0]
+        if value != value:  # NaN
+            return None
+        return value
+
+    def get_rate(self, base, currency, date):
+        """Return rate from @base to @currency on @date."""
+        position = self.find_date(date)
+        if base != self.base or currency not in self.currencies or position is None:
+            raise RatesNotAvailableError('Currency {0} => {1} rate not available in snapshot '
+                                         'for date {2}.'.format(base, currency, date_key(date)))
+        value = self.rate(currency, position)
+        if value is None:
+            raise RatesNotAvailableError('Currency {0} => {1} rate not available in snapshot '
+                                         'for date {2}.'.format(base, currency, date_key(date)))
+        return value
+
+    def get_rates(self, base, date):
+        """Return rate table for @base on @date."""
+        position = self.find_date(date)
+        if base != self.base or position is None:
+            raise RatesNotAvailableError('Rates for {0} not available in snapshot for date {1}.'.
+                                         format(base, date_key(date)))
+        table = {}
+        for currency in self.currencies:
+            value = self.rate(currency, position)
+            if value is not None:
+                table[currency] = value
+        return table
+
+    def close(self):
+        """Unmap the snapshot."""
+        self.data.close()
+
+
+def snapshot_padding(offset):
+    """Return @offset rounded up to a multiple of 8."""
+    return (offset + 7) & ~7
+
+
+def export_snapshot(filename, base, tables):
+    """Write all (date, rate table) @tables for @base to snapshot @filename.
+
+    Returns the number of exported dates.
+    """
+    tables = sorted(tables, key=lambda item: item[0])
+    currencies = sorted(set(currency for _, table in tables for currency in table
+                            if len(currency) == 3))
+    header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, base.encode('ascii'),
+                                  len(tables), len(currencies))
+    codes = ''.join(currencies).encode('ascii')
+    temporary = filename + '.tmp'
+    with open(temporary, 'wb') as snapshot:
+        snapshot.write(header + codes)
+        snapshot.write(b'\0' * (snapshot_padding(len(header) + len(codes)) -
+                                 len(header) - len(codes)))
+        snapshot.write(struct.pack('<{0}i'.format(len(tables)),
+                                   *[date.toordinal() for date, _ in tables]))
+        for currency in currencies:
+            snapshot.write(struct.pack('<{0}d'.format(len(tables)),
+                                       *[float(table.get(currency, float('nan')))
+                                         for _, table in tables]))
+    os.replace(temporary, filename)
+    return len(tables)
+
+
+def date_key(date):
+    """Return the string representation of @date used as key."""
+    return date.strftime('%Y-%m-%d')
+
+
+def end_of_day(date):
+    """Return the timestamp at which @date has ended (in local time)."""
+    return time.mktime((date.date() + timedelta(days=1)).timetuple())
+
+
+def today():
+    """Return the start of today, the default date of conversions."""
+    return datetime.today().replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def date_range(start, end):
+    """Yield all dates from @start up to and including @end."""
+    while start <= end:
+        yield start
+        start += timedelta(days=1)
+
+
+def get_rates(rates, cache, base, date):
+    """Return rate table for @base on @date, using the cache when possible."""
+    table = None
+    if cache:
+        table = cache.get(base, date)
+    if table is None:
+        table = rates.get_rates(base, date)
+        if cache:
+            cache.store(base, date, table)
+    return table
+
+
+class RateClient(object):
+    """Retrieve rates from a running convert_currency service.
+
+    Offers the same get_rate interface as CrossRates, over one persistent
+    connection.
+    """
+
+    def __init__(self, address):
+        if isinstance(address, tuple):
+            self.socket = socket.create_connection(address)
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        else:
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.connect(address)
+        self.stream = self.socket.makefile('rwb')
+        self.rates = {}
+
+    def query(self, request):
+        """Send @request (a query or list of queries) and return the answer."""
+        self.stream.write(json.dumps(request).encode('utf-8') + b'\n')
+        self.stream.flush()
+        answer = self.stream.readline()
+        if not answer:
+            raise RatesNotAvailableError('Connection to service closed')
+        return json.loads(answer.decode('utf-8'))
+
+    def get_rate(self, from_currency, to_currency, date):
+        """Return rate from @from_currency to @to_currency on @date."""
+        key = (from_currency, to_currency, date_key(date))
+        if key not in self.rates:
+            self.rates[key] = self.query({'from': from_currency, 'to': to_currency,
+                                          'date': key[2]})['rate']
+        if self.rates[key] is None:
+            raise RatesNotAvailableError('Currency {0} => {1} rate not available for date {2}.'.
+                                         format(*key))
+        return self.rates[key]
+
+    def close(self):
+        """Close the connection to the service."""
+        self.stream.close()
+        self.socket.close()
+
+
+class ConversionHandler(socketserver.StreamRequestHandler):
+    """Answer conversion queries, one JSON query or list of queries per line."""
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line.decode('utf-8'))
+                if isinstance(request, list):
+                    answer = list(convert_records(request, self.server.cross_rates,
+                                                  self.server.options))
+                else:
+                    answer = next(convert_records([request], self.server.cross_rates,
+                                                  self.server.options))
+            except (AttributeError, KeyError, TypeError, ValueError) as exception:
+                answer = {'error': 'Invalid query: {0}'.format(exception)}
+            self.wfile.write(json.dumps(answer).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+class ConversionTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """Threaded TCP conversion service."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class ConversionUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Threaded Unix socket conversion service."""
+
+    daemon_threads = True
+
+
+def parse_address(value):
+    """Parse HOST:PORT into a tuple, or return @value as Unix socket path."""
+    host, _, port = value.rpartition(':')
+    if host and port.isdigit() and '/' not in value:
+        return host, int(port)
+    return value
+
+
+def serve(cross_rates, options):
+    """Answer conversion queries on the service address until interrupted."""
+    address = options['serve']
+    if isinstance(address, tuple):
+        server = ConversionTCPServer(address, ConversionHandler)
+    else:
+        if os.path.exists(address):
+            os.unlink(address)
+        server = ConversionUnixServer(address, ConversionHandler)
+    server.cross_rates = cross_rates
+    server.options = options
+    print('Serving conversions on {0}'.format(options['serve']))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if not isinstance(address, tuple):
+            os.unlink(address)
+
+
+class AsyncRateFetcher(object):
+    """Fetch rate tables for many dates concurrently.
+
+    At most @concurrency requests are in flight, each over its own keep-alive
+    connection which is reused for subsequent requests. Failed requests are
+    retried @retries times with exponential backoff.
+    """
+
+    def __init__(self, url=RATES_URL, concurrency=8, retries=3, backoff=0.5, timeout=10):
+        self.url = urllib.parse.urlsplit(url)
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+    def connect(self):
+        """Return a new (not yet opened) connection to the rate provider."""
+        import http.client  # pylint: disable=import-outside-toplevel
+        if self.url.scheme == 'https':
+            return http.client.HTTPSConnection(self.url.netloc, timeout=self.timeout)
+        return http.client.HTTPConnection(self.url.netloc, timeout=self.timeout)
+
+    def request(self, connection, base, date):
+        """Perform a blocking request for @base on @date and return status and body."""
+        import http.client  # pylint: disable=import-outside-toplevel
+        path = '{0}{1}?{2}'.format(self.url.path or '/', date_key(date),
+                                   urllib.parse.urlencode({'base': base, 'rtype': 'fpy'}))
+        try:
+            connection.request('GET', path, headers={'Connection': 'keep-alive'})
+            response = connection.getresponse()
+            return response.status, response.read()
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            raise
+
+    async def fetch(self, pool, executor, base, date):
+        """Fetch the rate table for @base on @date, using a connection from @pool."""
+        import asyncio  # pylint: disable=import-outside-toplevel
+        import http.client  # pylint: disable=import-outside-toplevel
+        loop = asyncio.get_event_loop()
+        connection = await pool.get()
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    status, body = await loop.run_in_executor(executor, self.request,
+                                                              connection, base, date)
+                    if status == 200:
+                        return json.loads(body.decode('utf-8')).get('rates', {})
+                    if status < 500 and status != 429:
+                        break
+                except (OSError, http.client.HTTPException, ValueError):
+                    pass
+                if attempt < self.retries:
+                    await asyncio.sleep(self.backoff * 2 ** attempt)
+        finally:
+            pool.put_nowait(connection)
+        raise RatesNotAvailableError('Currency Rates Source Not Ready for {0}'.
+                                     format(date_key(date)))
+
+    async def fetch_all(self, base, dates):
+        """Return dictionary of date => rate table (or exception) for all @dates."""
+        import asyncio  # pylint: disable=import-outside-toplevel
+        import concurrent.futures  # pylint: disable=import-outside-toplevel
+        pool = asyncio.Queue()
+        for _ in range(self.concurrency):
+            pool.put_nowait(self.connect())
+        with concurrent.futures.ThreadPoolExecutor(self.concurrency) as executor:
+            results = await asyncio.gather(*[self.fetch(pool, executor, base, date)
+                                             for date in dates], return_exceptions=True)
+        while not pool.empty():
+            pool.get_nowait().close()
+        return dict(zip(dates, results))
+
+    def fetch_rates(self, base, dates):
+        """Blocking wrapper around fetch_all."""
+        import asyncio  # pylint: disable=import-outside-toplevel
+        return asyncio.run(self.fetch_all(base, list(dates)))
+
+    def get_rates(self, base, date):
+        """Return the rate table for @base on @date, raising RatesNotAvailableError."""
+        table = self.fetch_rates(base, [date])[date]
+        if isinstance(table, Exception):
+            raise table
+        return table
+
+
+class CrossRates(object):
+    """Rates between all currency pairs, derived from the rate table of one base.
+
+    Only one rate table per date is fetched (or read from the cache), which is
+    then kept in memory. Rate A => B is calculated as (base => B) / (base => A).
+    """
+
+    def __init__(self, rates, cache, base=BASE_CURRENCY, ttl=CACHE_TTL):
+        self.rates = rates
+        self.cache = cache
+        self.base = base
+        self.ttl = ttl
+        self.tables = {}
+        self.expires = {}
+        self.lock = threading.Lock()
+
+    def table(self, date):
+        """Return rate table for the base on @date, including the base itself.
+
+        Tables of dates that haven't ended yet (and unavailable tables) are
+        retrieved again after the time to live has passed.
+        """
+        key = date_key(date)
+        with self.lock:
+            now = time.time()
+            if key not in self.tables or (key in self.expires and self.expires[key] < now):
+                try:
+                    table = dict(get_rates(self.rates, self.cache, self.base, date))
+                except RatesNotAvailableError:
+                    self.tables[key] = {}
+                    self.expires[key] = now + self.ttl
+                    raise
+                table[self.base] = 1.0
+                self.store(key, date, table, now)
+            return self.tables[key]
+
+    def store(self, key, date, table, now):
+        """Keep @table under @key, letting it expire when @date hasn't ended at @now."""
+        self.tables[key] = table
+        if now < end_of_day(date):
+            self.expires[key] = now + self.ttl
+        else:
+            self.expires.pop(key, None)
+
+    def add(self, date, table):
+        """Add rate table for the base on @date."""
+        table = dict(table)
+        table[self.base] = 1.0
+        with self.lock:
+            self.store(date_key(date), date, table, time.time())
+
+    def get_rate(self, from_currency, to_currency, date):
+        """Return rate from @from_currency to @to_currency on @date."""
+        if from_currency == to_currency:
+            return 1.0
+        table = self.table(date)
+        if from_currency not in table or to_currency not in table:
+            raise RatesNotAvailableError('Currency {0} => {1} rate not available for date {2}.'.
+                                         format(from_currency, to_currency, date_key(date)))
+        if from_currency == self.base:
+            return table[to_currency]
+        return round(table[to_currency] / table[from_currency], 6)
+
+
+def prefetch(fetcher, cache, cross_rates, base, start, end):
+    """Retrieve rate tables for @base from @start to @end, skipping cached dates.
+
+    Tables are stored in the cache (if any) and added to @cross_rates.
+    Returns the number of fetched tables.
+    """
+    missing = []
+    for date in date_range(start, end):
+        table = cache.get(base, date) if cache else None
+        if table is None:
+            missing.append(date)
+        else:
+            cross_rates.add(date, table)
+    count = 0
+    for date, table in sorted(fetcher.fetch_rates(base, missing).items()):
+        if isinstance(table, Exception):
+            print('Could not retrieve rates for {0}: {1}'.format(date_key(date), table),
+                  file=sys.stderr)
+            continue
+        if cache:
+            cache.store(base, date, table)
+        cross_rates.add(date, table)
+        count += 1
+    return count
+
+
+def read_records(stream, fmt):
+    """Yield records (dictionaries) from CSV or JSONL @stream."""
+    if fmt == 'csv':
+        for record in csv.DictReader(stream):
+            yield record
+    else:
+        for line in stream:
+            if line.strip():
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = None
+                if not isinstance(record, dict):
+                    print('Could not read record {0}'.format(line.strip()), file=sys.stderr)
+                    continue
+                yield record
+
+
+def convert_records(records, cross_rates, options):
+    """Yield converted @records, resolving the rate table of each date only once."""
+    for record in records:
+        from_currency = record.get('from') or options['from']
+        to_currency = record.get('to') or options['to'][0]
+        date = record.get('date') or date_key(options['date'] or today())
+        result = {'amount': record.get('amount'), 'from': from_currency, 'to': to_currency,
+                  'date': date, 'rate': None, 'minus_fee': None, 'total': None,
+                  'plus_fee': None}
+        try:
+            if record.get('amount') in (None, ''):
+                raise ValueError('amount is missing')
+            result['amount'] = float(record['amount'])
+            result['rate'] = cross_rates.get_rate(from_currency, to_currency,
+                                                  datetime.strptime(date, '%Y-%m-%d'))
+        except RatesNotAvailableError as exception:
+            print('Could not convert rates: {0}'.format(exception), file=sys.stderr)
+        except (TypeError, ValueError) as exception:
+            # Report malformed records, without stopping the stream
+            print('Could not convert record {0}: {1}'.format(record, exception),
+                  file=sys.stderr)
+        if result['rate'] is not None:
+            result['total'] = round(result['rate'] * result['amount'], 2)
+            result['plus_fee'], result['minus_fee'] = calculate_fees(result['total'],
+                                                                      options['fee'], 2)
+        yield result
+
+
+def write_records(records, stream, fmt):
+    """Write converted @records to @stream as CSV or JSONL."""
+    if fmt == 'csv':
+        writer = csv.DictWriter(stream, fieldnames=BATCH_FIELDS, lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(records)
+    else:
+        for record in records:
+            stream.write(json.dumps(record) + '\n')
+
+
+def batch_convert(cross_rates, options):
+    """Stream records from the batch input to the batch output."""
+    input_format = options['input_format']
+    if not input_format:
+        input_format = 'csv' if options['batch'].endswith('.csv') else 'jsonl'
+    output_format = options['output_format'] or input_format
+    source = sys.stdin if options['batch'] == '-' else open(options['batch'])
+    destination = sys.stdout if options['output'] == '-' else open(options['output'], 'w')
+    try:
+        write_records(convert_records(read_records(source, input_format), cross_rates,
+                                      options), destination, output_format)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if destination is not sys.stdout:
+            destination.close()
+
+
+def parse_currencies(values):
+    """Return list of currencies from (comma separated) @values."""
+    currencies = []
+    for value in values or [BASE_CURRENCY]:
+        for currency in value.split(','):
+            if currency and currency not in currencies:
+                currencies.append(currency)
+    return currencies
+
+
+def convert(cross_rates, options, to_currency, dates):
+    """Print rates and converted amounts from the source currency to @to_currency."""
+    print('Converting from {0} to {1}'.format(options['from'], to_currency))
+    for date in dates:
+        try:
+            rate = cross_rates.get_rate(options['from'], to_currency, date)
+            add_fee, subtract_fee = calculate_fees(rate, options['fee'], 5)
+            print('{0}    {1:>10} {2:>10} {3:>10}'.format(date.strftime('%Y-%m-%d'),
+                                                          subtract_fee, rate,
+                                                          add_fee))
+            if options['amount']:
+                total = round(rate * options['amount'], 2)
+                add_fee, subtract_fee = calculate_fees(total, options['fee'], 2)
+                print(' {0:>6} {1} = {2:>10} {3:>10} {4:>10} {5}'.format(options['amount'],
+                                                                         options['from'],
+                                                                         subtract_fee,
+                                                                         total,
+                                                                         add_fee,
+                                                                         to_currency))
+        except RatesNotAvailableError as exception:
+            print('Could not convert rates: {0}'.format(exception), file=sys.stderr)
+
+
+def parse_date_range(value):
+    """Parse START:END into a tuple of datetimes."""
+    try:
+        start, end = value.split(':')
+        return (datetime.strptime(start, '%Y-%m-%d'), datetime.strptime(end, '%Y-%m-%d'))
+    except ValueError:
+        raise argparse.ArgumentTypeError('Date ranges must be in the form '
+                                         'YYYY-mm-dd:YYYY-mm-dd')
 
 
 def calculate_fees(amount, fee, decimals):
@@ -40,6 +645,70 @@ def calculate_fees(amount, fee, decimals):
     return add_fee, subtract_fee
 
 
+def product_error(first, second, product):
+    """Return the rounding error of @product = @first * @second (Dekker's algorithm).
+
+    The error is exact, as long as nothing overflows or underflows.
+    """
+    def split(value):
+        """Split @value into a high and low half of 26 bits each."""
+        scaled = 134217729.0 * value  # 2 ** 27 + 1
+        high = scaled - (scaled - value)
+        return high, value - high
+
+    first_high, first_low = split(first)
+    second_high, second_low = split(second)
+    return (((first_high * second_high - product) + first_high * second_low +
+             first_low * second_high) + first_low * second_low)
+
+
+def round_array(values, decimals):
+    """Round NumPy array @values exactly like the builtin round does.
+
+    round rounds the exact value half to even, whereas numpy.round rounds the
+    (already rounded) product with 10 ** @decimals, which differs for values
+    that lie (almost) exactly halfway. Here the exact rounding error of that
+    product decides which way halfway values are rounded. Values that are too
+    large (or not finite) are rounded one by one.
+    """
+    import numpy  # pylint: disable=import-outside-toplevel
+    if not 0 <= decimals <= 22:  # 10 ** decimals isn't exact
+        return numpy.array([round(value, decimals) for value in values.tolist()])
+    scale = float(10 ** decimals)
+    magnitudes = numpy.abs(values)
+    with numpy.errstate(over='ignore', invalid='ignore'):
+        scaled = magnitudes * scale
+        error = product_error(magnitudes, scale, scaled)
+        whole = numpy.floor(scaled)
+        fraction = scaled - whole
+        halfway = fraction == 0.5
+        up = (fraction > 0.5) | (halfway & (error > 0)) | \
+            (halfway & (error == 0) & (numpy.floor(whole / 2) != whole / 2))
+        rounded = numpy.copysign((whole + up) / scale, values)
+    for index in numpy.flatnonzero(~(scaled < 2.0 ** 52)):
+        rounded.flat[index] = round(float(values.flat[index]), decimals)
+    return rounded
+
+
+def calculate_fees_array(amounts, fee, decimals):
+    """Calculate amounts minus and plus fees for an array (or any buffer) of amounts.
+
+    Returns the same values as calculate_fees for each amount. Without NumPy
+    lists are returned.
+    """
+    try:
+        import numpy  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        numpy = None
+    if numpy is None:
+        fees = [calculate_fees(amount, fee, decimals) for amount in amounts]
+        return [item[0] for item in fees], [item[1] for item in fees]
+    amounts = numpy.asarray(amounts, dtype=float)
+    add_fee = round_array(amounts * (fee/100), decimals)
+    subtract_fee = round_array(amounts / (fee/100), decimals)
+    return add_fee, subtract_fee
+
+
 def parse_arguments(banner):
     """Parse and return command line arguments."""
     parser = argparse.ArgumentParser(
@@ -57,51 +726,128 @@ the Free Software Foundation, either version 3 of the License, or
                         help='Amount to convert')
     parser.add_argument('--amount', action='store', type=float,
                         help='Amount to convert from')
-    parser.add_argument('--date', action='store', default=datetime.strftime(datetime.today(),
-                                                                            '%Y-%m-%d'),
-                        help='Specify date (default today, %(default)s)')
+    parser.add_argument('--batch', action='store', metavar='FILE',
+                        help='Convert all records (amount, from, to, date) from FILE '
+                        '(CSV or JSONL, - for stdin)')
+    parser.add_argument('--input-format', action='store', choices=['csv', 'jsonl'],
+                        help='Format of the batch input (default based on extension)')
+    parser.add_argument('--output', action='store', default='-',
+                        help='Output file for batch conversions (default stdout)')
+    parser.add_argument('--output-format', action='store', choices=['csv', 'jsonl'],
+                        help='Format of the batch output (default input format)')
+    parser.add_argument('--base', action='store', default=BASE_CURRENCY,
+                        help='Base currency of the fetched rate tables (default %(default)s)')
+    parser.add_argument('--cache', action='store', default=CACHE_FILE,
+                        help='Rate cache file (default %(default)s)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Do not use the rate cache')
+    parser.add_argument('--ttl', action='store', type=int, default=CACHE_TTL,
+                        help='Seconds that rates fetched on their date are cached '
+                        '(default %(default)s)')
+    parser.add_argument('--prefetch', action='store', type=parse_date_range,
+                        metavar='FROM:TO',
+                        help='Fill the rate cache for the date range FROM:TO and exit')
+    parser.add_argument('--serve', action='store', type=parse_address, metavar='ADDRESS',
+                        help='Run as service, answering queries on ADDRESS '
+                        '(Unix socket path or HOST:PORT)')
+    parser.add_argument('--connect', action='store', type=parse_address, metavar='ADDRESS',
+                        help='Retrieve rates from the service running on ADDRESS')
+    parser.add_argument('--export-snapshot', action='store', metavar='FILE',
+                        help='Export all cached rates of the base currency to snapshot FILE')
+    parser.add_argument('--snapshot', action='store', metavar='FILE',
+                        help='Look up rates in snapshot FILE instead of online')
+    parser.add_argument('--date-range', action='store', type=parse_date_range,
+                        metavar='START:END',
+                        help='Convert for every date from START to END')
+    parser.add_argument('--source-url', action='store', default=RATES_URL,
+                        help='URL of the rate provider, used for all rates '
+                        '(default %(default)s)')
+    parser.add_argument('--concurrency', action='store', type=int, default=8,
+                        help='Maximum number of concurrent requests (default %(default)s)')
+    parser.add_argument('--retries', action='store', type=int, default=3,
+                        help='Number of retries for failed requests (default %(default)s)')
+    parser.add_argument('--date', action='store',
+                        help='Specify date (default today, also for every query of the service)')
     parser.add_argument('--fee', action='store', type=float, default=2.5,
                         help=r'Exchange rate fee in %% (default %(default)s)')
     parser.add_argument('--from', action='store', default='EUR',
                         help='Currency symbol to convert from (default %(default)s)')
-    parser.add_argument('--to', action='store', default='EUR',
-                        help='Currency symbol to convert to (default %(default)s)')
+    parser.add_argument('--to', action='append',
+                        help='Currency symbol(s) to convert to, can be specified '
+                        'multiple times or comma separated (default {0})'.format(BASE_CURRENCY))
     return vars(parser.parse_args())
 
 
+def setup_rates(options):
+    """Return CrossRates according to options, and handle the local rate store.
+
+    Prefetching, exporting and serving are handled here, after which the
+    program exits.
+    """
+    cache = None
+    if options['snapshot']:
+        try:
+            rates = RateSnapshot(options['snapshot'])
+        except (OSError, ValueError) as exception:
+            print('Could not open snapshot: {0}'.format(exception), file=sys.stderr)
+            sys.exit(-1)
+    fetcher = AsyncRateFetcher(options['source_url'], options['concurrency'],
+                               options['retries'])
+    if not options['snapshot']:
+        # All rates, of single dates and of ranges, come from --source-url
+        rates = fetcher
+        if not options['no_cache']:
+            cache = RateCache(options['cache'], options['ttl'])
+    cross_rates = CrossRates(rates, cache, options['base'], options['ttl'])
+    if (options['prefetch'] or options['export_snapshot']) and not cache:
+        print('Prefetching and exporting needs the rate cache', file=sys.stderr)
+        sys.exit(-1)
+    if options['prefetch']:
+        count = prefetch(fetcher, cache, cross_rates, options['base'], *options['prefetch'])
+        print('Stored {0} rate tables for {1}'.format(count, options['base']))
+    if options['export_snapshot']:
+        count = export_snapshot(options['export_snapshot'], options['base'],
+                                cache.tables(options['base']))
+        print('Exported {0} rate tables for {1} to {2}'.format(count, options['base'],
+                                                               options['export_snapshot']))
+    if options['prefetch'] or options['export_snapshot']:
+        sys.exit(0)
+    if options['serve']:
+        serve(cross_rates, options)
+        sys.exit(0)
+    if options['date_range'] and not options['snapshot']:
+        prefetch(fetcher, cache, cross_rates, options['base'], *options['date_range'])
+    return cross_rates
+
+
 def main():
     """Main program loop."""
     banner = 'convert_currency version {0}'.format(VERSION)
     options = parse_arguments(banner)
     options['fee'] = 100 + options['fee']
-    try:
-        options['date'] = datetime.strptime(options['date'], '%Y-%m-%d')
-    except ValueError as exception:
-        print('Dates must be in the form YYYY-mm-dd: {0}'.format(exception, file=sys.stderr))
-        sys.exit(-1)
-    rates = CurrencyRates()
-    print('Converting from {0} to {1}'.format(options['from'], options['to']))
-    try:
-        rate = rates.get_rate(options['from'], options['to'], options['date'])
-        add_fee, subtract_fee = calculate_fees(rate, options['fee'], 5)
-        print('{0}    {1:>10} {2:>10} {3:>10}'.format(options['date'].
-                                                      strftime('%Y-%m-%d'),
-                                                      subtract_fee, rate,
-                                                      add_fee))
-        if options['amount']:
-            total = round(rate * options['amount'], 2)
-            add_fee, subtract_fee = calculate_fees(total, options['fee'], 2)
-            print(' {0:>6} {1} = {2:>10} {3:>10} {4:>10} {5}'.format(options['amount'],
-                                                                     options['from'],
-                                                                     subtract_fee,
-                                                                     total,
-                                                                     add_fee,
-                                                                     options['to']))
-    except RatesNotAvailableError as exception:
-        print('Could not convert rates: {0}'.format(exception), file=sys.stderr)
-
-
-
+    if options['date']:
+        try:
+            options['date'] = datetime.strptime(options['date'], '%Y-%m-%d')
+        except ValueError as exception:
+            print('Dates must be in the form YYYY-mm-dd: {0}'.format(exception), file=sys.stderr)
+            sys.exit(-1)
+    options['to'] = parse_currencies(options['to'])
+    if options['connect']:
+        try:
+            cross_rates = RateClient(options['connect'])
+        except OSError as exception:
+            print('Could not connect to service: {0}'.format(exception), file=sys.stderr)
+            sys.exit(-1)
+    else:
+        cross_rates = setup_rates(options)
+    if options['batch']:
+        batch_convert(cross_rates, options)
+        sys.exit(0)
+    dates = [options['date'] or today()]
+    if options['date_range']:
+        dates = list(date_range(*options['date_range']))
+    for to_currency in options['to']:
+        convert(cross_rates, options, to_currency, dates)
 
 
 if __name__ == "__main__":
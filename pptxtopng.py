@@ -17,23 +17,64 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import argparse
+import filecmp
+import glob
+import hashlib
+import json
 import logging
+import multiprocessing
 import os
+import pathlib
+import posixpath
+import queue
+import struct
+import subprocess
 import sys
+import tempfile
 import textwrap
-from shutil import copyfile
+import time
+import zipfile
+import zlib
+from concurrent.futures import (ALL_COMPLETED, FIRST_COMPLETED, ProcessPoolExecutor,
+                                ThreadPoolExecutor, wait)
+from shutil import copyfile, rmtree
+from xml.etree import ElementTree
 
 
 __title__ = "pptxtopng"
-__version__ = "0.5.0"
+__version__ = "0.11.0"
+VARIANTS_MANIFEST = "pptxtopng.variants.json"
+# Image format => (Pillow format, extension, name of the compression parameter)
+VARIANT_FORMATS = {"png": ("PNG", "png", "compress_level"),
+                   "webp": ("WEBP", "webp", "quality"),
+                   "jpeg": ("JPEG", "jpg", "quality")}
+# ioctl to clone a file on copy-on-write filesystems (Linux)
+FICLONE = 0x40049409
+INDEX_CACHE = os.path.join(os.path.expanduser("~"), ".pptxtopng.cache")
+# Resolution of slides rendered by LibreOffice, matching PowerPoint's default export
+RESOLUTION = 96
+MANIFEST = "pptxtopng.json"
+NAMESPACES = {
+    "p": "http://schemas.openxmlformats.org/presentationml/2006/main",
+    "p14": "http://schemas.microsoft.com/office/powerpoint/2010/main",
+    "r": "http://schemas.openxmlformats.org/officeDocument/2006/relationships",
+    "rel": "http://schemas.openxmlformats.org/package/2006/relationships"}
+# Relationships that don't influence the rendering of a slide
+IGNORED_RELATIONSHIPS = ("/notesSlide", "/comments", "/tags")
 
 
 try:
     import comtypes.client
-except ImportError as exception:
-    print(f"Please install all required libraries: {exception}",
-          file=sys.stderr)
-    sys.exit(-1)
+except ImportError:
+    comtypes = None  # pylint: disable=invalid-name
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # pylint: disable=invalid-name
+try:
+    from PIL import Image
+except ImportError:
+    Image = None  # pylint: disable=invalid-name
 
 
 class LogFormatter(logging.Formatter):
@@ -50,6 +91,10 @@ class LogFormatter(logging.Formatter):
         return logging.Formatter.format(self, record)
 
 
+class ExportError(Exception):
+    """Raised when a slidedeck can't be exported."""
+
+
 class LogFilter():  # pylint: disable=too-few-public-methods
     """Class to remove certain log levels."""
     def __init__(self, filterlist):
@@ -78,6 +123,32 @@ def setup_logging(options):
     logger.addHandler(errors)
 
 
+def parse_variant(specification):
+    """Parse image variant NAME:SIZE:FORMAT[:LEVEL] into a (name, size, format, level) tuple."""
+    fields = specification.split(":")
+    if len(fields) not in (3, 4) or fields[2] not in VARIANT_FORMATS:
+        raise argparse.ArgumentTypeError(f"invalid variant {specification}")
+    size = None
+    try:
+        if fields[1] != "-":
+            size = [int(value) for value in fields[1].split("x")]
+        level = int(fields[3]) if len(fields) == 4 else None
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid variant {specification}")
+    return fields[0], size, fields[2], level
+
+
+def parse_sections(value):
+    """Parse comma-separated section numbers (starting at 1) into a list."""
+    try:
+        sections = [int(section) for section in value.split(",")]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid section number(s) {value}")
+    if any(section < 1 for section in sections):
+        raise argparse.ArgumentTypeError(f"section numbers start at 1: {value}")
+    return sections
+
+
 def parse_arguments(banner):
     """Parse and return command line arguments."""
     parser = argparse.ArgumentParser(
@@ -92,17 +163,45 @@ it under the terms of the GNU General Public License as published by
 the Free Software Foundation, either version 3 of the License, or
 (at your option) any later version.'''))
     parser.add_argument("slides", nargs="?", type=str, default="slides.pptx",
-                        help="PowerPoint slidedeck (default %(default)s)")
+                        help="PowerPoint slidedeck, or directory or manifest of slidedecks "
+                        "with --batch (default %(default)s)")
+    parser.add_argument("--batch", action="store_true",
+                        help="Export all slidedecks in directory or manifest (one per line) "
+                        "into a folder per slidedeck")
+    parser.add_argument("--jobs", action="store", type=int,
+                        help="Number of slidedecks to export at once with --batch, if the "
+                        "backend supports it (default number of workers)")
     parser.add_argument("--from", action="store", type=int,
                         help="Copy slide range from")
     parser.add_argument("--to", action="store", type=int,
                         help="Copy slide range to")
     parser.add_argument("--copy", action="store", type=str,
                         help="Copy slide range / section output folder")
-    parser.add_argument("--section", action="store", type=int,
-                        help="Copy specified section to output folder")
+    parser.add_argument("--section", action="append", type=parse_sections,
+                        help="Copy specified section to output folder, can be specified "
+                        "multiple times or comma-separated")
     parser.add_argument("--single", action="store", type=int,
                         help="Copy single slide")
+    parser.add_argument("--cache", action="store", type=str, default=INDEX_CACHE,
+                        help="Cache of slidedeck indexes (default %(default)s)")
+    parser.add_argument("--no-cache", action="store_const", const=None, dest="cache",
+                        help="Don't use a cache of slidedeck indexes")
+    parser.add_argument("--force", action="store_true",
+                        help="Export all slides, even when they didn't change")
+    parser.add_argument("--backend", action="store", choices=sorted(BACKENDS),
+                        default="powerpoint" if os.name == "nt" else "libreoffice",
+                        help="Backend to render slides with (default %(default)s)")
+    parser.add_argument("--soffice", action="store", type=str, default="soffice",
+                        help="LibreOffice executable (default %(default)s)")
+    parser.add_argument("--workers", action="store", type=int,
+                        help="Number of LibreOffice processes, copy threads and "
+                        "image processes (default number of CPUs)")
+    parser.add_argument("--variant", action="append", type=parse_variant,
+                        help="Create image variant NAME:SIZE:FORMAT[:LEVEL] of each slide "
+                        "in folder NAME, where SIZE is WIDTH[xHEIGHT] or - for the "
+                        "original size, FORMAT is png, webp or jpeg, and LEVEL the "
+                        "compression level (png) or quality (webp, jpeg). Requires Pillow, "
+                        "can be specified multiple times")
     parser.add_argument("-o", "--output", action="store", type=str,
                         default=".", help="Output path (default %(default)s)")
     parser.add_argument('--debug', action='store_true',
@@ -120,8 +219,7 @@ def get_presentation(powerpoint, path, name):
             break
     if not opened:
         if not os.path.isfile(path + '\\' + name):
-            logging.error(r"Could not find %s\%s", path, name)
-            sys.exit(-1)
+            raise ExportError(f"Could not find {path}\\{name}")
         logging.debug("Opening presentation")
         presentation = powerpoint.Presentations.Open(path + '\\' + name)
     return presentation, opened
@@ -129,20 +227,24 @@ def get_presentation(powerpoint, path, name):
 
 def windows_path(pathname):
     """Convert non-Windows pathname into Windows pathname."""
+    if os.name != "nt":
+        return pathname
     return pathname.replace('/', '\\')
 
 
 def get_section_range(presentation, section):
     """Return the start and end range of a specified section."""
-    if section >= presentation.SectionProperties.Count:
-        logging.error(f"This presentation only has {presentation.SectionProperties.Count} sections")
-        sys.exit(-1)
+    if section > presentation.SectionProperties.Count:
+        raise ExportError(f"This presentation only has "
+                          f"{presentation.SectionProperties.Count} sections")
     range_from = presentation.SectionProperties.FirstSlide(section)
-    return range_from, range_from + presentation.SectionProperties.SlidesCount(section)
+    return range_from, range_from + presentation.SectionProperties.SlidesCount(section) - 1
 
 
 def get_powerpoint():
     """Open Powerpoint application."""
+    if not comtypes:
+        raise ExportError("Please install comtypes to use the powerpoint backend")
     try:
         powerpoint = comtypes.client.GetActiveObject("Powerpoint.Application")
     except WindowsError:
@@ -150,50 +252,670 @@ def get_powerpoint():
         powerpoint = comtypes.client.CreateObject("Powerpoint.Application")
     # powerpoint.Visible = True
     if not powerpoint:
-        logging.error("Could not open PowerPoint")
-        sys.exit(-1)
+        raise ExportError("Could not open PowerPoint")
     return powerpoint
 
 
 def check_file(name):
     """Checks whether filename and path exist."""
     if not os.path.isfile(name):
-        logging.error(f"Could not find {name}")
-        sys.exit(-1)
+        raise ExportError(f"Could not find {name}")
 
 
 def check_path(path):
     """Check whether pathname exists."""
     if not os.path.isdir(path):
-        logging.error("Could not find {path}")
-        sys.exit(-1)
+        raise ExportError(f"Could not find {path}")
 
 
-def copy_slides(source, dest, range_from, range_to, prefix=0):
-    """Copy @rangefrom to @rangeto slides from@source to @destination"""
-    logging.info(f"Copying slides {range_from} from {range_to} to {dest}")
-    for index in range(range_from, range_to + 1):  # Include to
-        file_source = os.path.join(source, f"Slide{index}.PNG")
-        if os.path.isfile(file_source):
-            file_dest = os.path.join(windows_path(os.path.join(os.getcwd(), dest)),
-                                     f"Slide{prefix}-{index-range_from+1:02}.png")
+def execute_command(cmd):
+    """Execute command @cmd and raise ExportError when it fails."""
+    logging.debug(f"Executing {' '.join(cmd)}")
+    try:
+        process = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                 check=False)
+    except OSError as exception:
+        raise ExportError(f"Could not execute {cmd[0]}: {exception}")
+    if process.returncode:
+        raise ExportError(f"{cmd[0]} failed: {process.stderr.decode('utf-8', 'replace')}")
+
+
+def reflink(source, dest):
+    """Clone @source as @dest, sharing the data on copy-on-write filesystems."""
+    if not fcntl:
+        raise OSError("Cloning files isn't supported on this platform")
+    with open(source, "rb") as input_file, open(dest, "wb") as output:
+        fcntl.ioctl(output.fileno(), FICLONE, input_file.fileno())
+
+
+def publish_file(source, dest, same_device):
+    """Publish @source as @dest, and return how it was published.
+
+    Identical files are skipped. When possible the file is hardlinked or
+    cloned, otherwise copied (copyfile uses sendfile where available).
+    """
+    if os.path.isfile(dest) and (os.path.samefile(source, dest) or
+                                 filecmp.cmp(source, dest, shallow=False)):
+        return "unchanged"
+    temporary = dest + ".tmp"
+    if os.path.lexists(temporary):
+        os.remove(temporary)
+    method = "copied"
+    if same_device:
+        try:
+            os.link(source, temporary)
+            method = "linked"
+        except OSError:
             try:
-                copyfile(file_source, file_dest)
-            except (FileNotFoundError, PermissionError) as exception:
-                logging.error(f"Could not copy {file_source} to {file_dest}:, {exception}")
+                reflink(source, temporary)
+                method = "cloned"
+            except OSError:
+                pass
+    if method == "copied":
+        copyfile(source, temporary)
+    os.replace(temporary, dest)
+    return method
+
+
+def publish_slides(source, dest, ranges, workers=None):
+    """Publish slides of @ranges (from, to, prefix) from @source to @destination."""
+    start = time.time()
+    dest = windows_path(os.path.join(os.getcwd(), dest))
+    check_path(dest)
+    same_device = os.stat(source).st_dev == os.stat(dest).st_dev
+    jobs = []
+    for range_from, range_to, prefix in ranges:
+        logging.info(f"Copying slides {range_from} to {range_to} to {dest}")
+        for index in range(range_from, range_to + 1):  # Include to
+            file_source = os.path.join(source, f"Slide{index}.PNG")
+            if os.path.isfile(file_source):
+                jobs.append((file_source, os.path.join(
+                    dest, f"Slide{prefix}-{index-range_from+1:02}.png")))
+            else:
+                logging.error(f"Could not find slide {file_source}")
+
+    def publish(job):
+        """Publish a single slide."""
+        file_source, file_dest = job
+        try:
+            return publish_file(file_source, file_dest, same_device)
+        except OSError as exception:
+            logging.error(f"Could not copy {file_source} to {file_dest}: {exception}")
+            return "failed"
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as executor:
+        methods = list(executor.map(publish, jobs))
+    summary = ", ".join(f"{methods.count(method)} {method}"
+                        for method in sorted(set(methods)))
+    logging.info(f"Published {len(jobs)} slides ({summary}) in "
+                 f"{time.time() - start:.3f} seconds")
+
+
+def variant_filename(export_path, variant, index):
+    """Return filename of @variant of slide @index."""
+    return os.path.join(export_path, variant[0],
+                        f"Slide{index}.{VARIANT_FORMATS[variant[2]][1]}")
+
+
+def render_variants(source, variants):
+    """Decode @source once and save all @variants (name, size, format, level, filename)."""
+    with Image.open(source) as image:
+        image.load()
+        for _, size, image_format, level, filename in variants:
+            output = image
+            if size:
+                output = image.copy()
+                # A single dimension only limits the width
+                output.thumbnail((size[0], size[-1] if len(size) > 1 else image.height),
+                                 Image.LANCZOS)
+            pillow_format, _, parameter = VARIANT_FORMATS[image_format]
+            if pillow_format == "JPEG" and output.mode not in ("L", "RGB"):
+                output = output.convert("RGB")
+            parameters = {"optimize": True} if pillow_format != "WEBP" else {"method": 6}
+            if level is not None:
+                parameters[parameter] = level
+            output.save(filename + ".tmp", pillow_format, **parameters)
+            os.replace(filename + ".tmp", filename)
+
+
+def process_variants(export_path, variants, slides, executor, workers):
+    """Create all @variants of @slides (slide numbers) in process pool @executor.
+
+    Slides are only decoded when their image or the variants changed since
+    the last run. At most two slides per process (@workers) are queued at
+    once, so that memory usage doesn't depend on the number of slides.
+    """
+    start = time.time()
+    for variant in variants:
+        if not os.path.isdir(os.path.join(export_path, variant[0])):
+            os.mkdir(os.path.join(export_path, variant[0]))
+    manifest_file = os.path.join(export_path, VARIANTS_MANIFEST)
+    manifest = load_cache(manifest_file)
+    specification = json.dumps(variants)
+    pending, processed = {}, []
+
+    def collect(return_when):
+        """Wait for pending slides and record the results."""
+        done, _ = wait(pending, return_when=return_when)
+        for future in done:
+            source, entry = pending.pop(future)
+            try:
+                future.result()
+                manifest[source] = entry
+                processed.append(source)
+            except (OSError, ValueError) as exception:
+                logging.error(f"Could not create variants of {source}: {exception}")
+
+    for index in slides:
+        source = os.path.join(export_path, f"Slide{index}.PNG")
+        try:
+            stat = os.stat(source)
+        except OSError:
+            logging.error(f"Could not find slide {source}")
+            continue
+        entry = {"size": stat.st_size, "mtime": stat.st_mtime, "variants": specification}
+        targets = [tuple(variant) + (variant_filename(export_path, variant, index),)
+                   for variant in variants]
+        if manifest.get(source) == entry and all(os.path.isfile(target[-1])
+                                                for target in targets):
+            continue
+        manifest.pop(source, None)
+        pending[executor.submit(render_variants, source, targets)] = (source, entry)
+        if len(pending) >= 2 * workers:
+            collect(FIRST_COMPLETED)
+    if pending:
+        collect(ALL_COMPLETED)
+    save_cache(manifest_file, manifest)
+    logging.info(f"Created {len(variants)} variants of {len(processed)} slides in "
+                 f"{time.time() - start:.3f} seconds")
+
+
+def read_relationships(archive, part):
+    """Return dictionary of relationship id => (type, target part) of @part."""
+    folder, name = posixpath.split(part)
+    try:
+        root = ElementTree.fromstring(archive.read(posixpath.join(folder, "_rels",
+                                                                  name + ".rels")))
+    except KeyError:
+        return {}
+    relationships = {}
+    for relationship in root.findall("rel:Relationship", NAMESPACES):
+        if relationship.get("TargetMode") == "External":
+            continue
+        target = relationship.get("Target")
+        if target.startswith("/"):
+            target = target[1:]
         else:
-            logging.error(f"Could not find slide {file_source}")
-
-
-def close_presentation(powerpoint, slidename):
-    """Close presentation and powerpoint, if no presentations are open."""
-    for presentation in powerpoint.Presentations:
-        if presentation.Name == slidename:
+            target = posixpath.normpath(posixpath.join(folder, target))
+        relationships[relationship.get("Id")] = (relationship.get("Type"), target)
+    return relationships
+
+
+def read_index(archive):
+    """Return part names of all slides in presentation order, and all sections.
+
+    Sections are (name, first slide, number of slides) tuples, and are read
+    from the section list extension of PowerPoint 2010.
+    """
+    relationships = read_relationships(archive, "ppt/presentation.xml")
+    root = ElementTree.fromstring(archive.read("ppt/presentation.xml"))
+    slides, positions = [], {}
+    for slide in root.findall("p:sldIdLst/p:sldId", NAMESPACES):
+        slides.append(relationships[slide.get(f"{{{NAMESPACES['r']}}}id")][1])
+        positions[slide.get("id")] = len(slides)
+    sections = []
+    for section in root.iter(f"{{{NAMESPACES['p14']}}}section"):
+        members = [positions[slide.get("id")] for slide in
+                   section.findall("p14:sldIdLst/p14:sldId", NAMESPACES)
+                   if slide.get("id") in positions]
+        sections.append((section.get("name"), min(members, default=0), len(members)))
+    return slides, sections
+
+
+def hash_slides(archive, slides):
+    """Return content hash of each slide part in @slides.
+
+    The hash covers the slide and every part it (indirectly) uses, like
+    layouts, masters, themes and media, but not its notes.
+    """
+    part_hashes = {}
+
+    def part_hash(part):
+        """Return (cached) hash of a single part."""
+        if part not in part_hashes:
+            try:
+                part_hashes[part] = hashlib.sha256(archive.read(part)).hexdigest()
+            except KeyError:
+                part_hashes[part] = ""
+        return part_hashes[part]
+
+    hashes = []
+    for slide in slides:
+        parts, todo = set(), [slide]
+        while todo:
+            part = todo.pop()
+            if part in parts:
+                continue
+            parts.add(part)
+            todo.extend(target for kind, target in
+                        read_relationships(archive, part).values()
+                        if not kind.endswith(IGNORED_RELATIONSHIPS))
+        digest = hashlib.sha256()
+        for part in sorted(parts):
+            digest.update(f"{part}:{part_hash(part)}\n".encode("utf-8"))
+        hashes.append(digest.hexdigest())
+    return hashes
+
+
+def load_cache(filename):
+    """Load cache of slidedeck => size, mtime and index."""
+    try:
+        with open(filename) as cache:
+            return json.load(cache)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cache(filename, cache):
+    """Save cache of slidedecks."""
+    with open(filename + ".tmp", "w") as output:
+        json.dump(cache, output, indent=0, sort_keys=True)
+    os.replace(filename + ".tmp", filename)
+
+
+def deck_index(slidedeck, cache):
+    """Return index of @slidedeck, only reading the slidedeck when size or mtime changed.
+
+    The index contains the slide parts, sections and slide hashes.
+    """
+    stat = os.stat(slidedeck)
+    entry = cache.get(slidedeck)
+    if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+        return entry
+    with zipfile.ZipFile(slidedeck) as archive:
+        slides, sections = read_index(archive)
+        entry = {"size": stat.st_size, "mtime": stat.st_mtime, "slides": slides,
+                 "sections": sections, "hashes": hash_slides(archive, slides)}
+    cache[slidedeck] = entry
+    return entry
+
+
+def section_range(index, section):
+    """Return the start and end range of a specified section of slidedeck @index."""
+    if section > len(index["sections"]):
+        raise ExportError(f"This presentation only has {len(index['sections'])} sections")
+    name, range_from, count = index["sections"][section - 1]
+    if not count:
+        raise ExportError(f"Section {section} ({name}) doesn't contain any slides")
+    return range_from, range_from + count - 1
+
+
+def load_manifest(export_path, name):
+    """Load manifest of slide number => content hash of the exported slides of @name."""
+    try:
+        with open(os.path.join(export_path, MANIFEST)) as manifest:
+            manifest = json.load(manifest)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get("deck") != name:
+        return {}
+    return manifest.get("slides", {})
+
+
+def save_manifest(export_path, name, manifest):
+    """Save manifest of the exported slides of @name."""
+    with open(os.path.join(export_path, MANIFEST), "w") as output:
+        json.dump({"deck": name, "slides": manifest}, output, indent=0, sort_keys=True)
+
+
+def changed_slides(export_path, hashes, manifest, slides):
+    """Return slide numbers of @slides that changed or were not exported yet."""
+    return [index for index in slides
+            if manifest.get(str(index)) != hashes[index - 1] or
+            not os.path.isfile(os.path.join(export_path, f"Slide{index}.PNG"))]
+
+
+def slide_runs(slides):
+    """Return list of (first, last) tuples of consecutive slide numbers in @slides."""
+    runs = []
+    for index in sorted(slides):
+        if runs and runs[-1][1] == index - 1:
+            runs[-1] = (runs[-1][0], index)
+        else:
+            runs.append((index, index))
+    return runs
+
+
+class Backend():
+    """Base class of the backends that render slides as Slide{index}.PNG files.
+
+    A backend renders any number of slidedecks, and keeps running until it is
+    shut down. Backends that set @concurrent can render slidedecks from
+    multiple threads at once. @slides is either a list of slide numbers or
+    None for all slides.
+    """
+    concurrent = False
+
+    def __init__(self, options):
+        self.options = options
+
+    def open(self, slidedeck):
+        """Prepare rendering of @slidedeck."""
+
+    def section_range(self, slidedeck, section):
+        """Return the start and end range of a specified section."""
+        raise ExportError(f"The {self.options['backend']} backend doesn't support sections")
+
+    def export(self, slidedeck, export_path, slides):
+        """Render @slides of @slidedeck into @export_path."""
+        raise NotImplementedError
+
+    def close(self, slidedeck):
+        """Finish rendering of @slidedeck."""
+
+    def shutdown(self):
+        """Release all resources of the backend."""
+
+
+class PowerPointBackend(Backend):
+    """Render slides using PowerPoint through COM."""
+    def __init__(self, options):
+        super().__init__(options)
+        self.powerpoint, self.presentations = None, {}
+
+    def open(self, slidedeck):
+        if slidedeck in self.presentations:
+            return
+        if not self.powerpoint:
+            self.powerpoint = get_powerpoint()
+        filename = windows_path(slidedeck)
+        self.presentations[slidedeck] = get_presentation(self.powerpoint,
+                                                         os.path.dirname(filename),
+                                                         os.path.basename(filename))
+
+    def section_range(self, slidedeck, section):
+        self.open(slidedeck)
+        return get_section_range(self.presentations[slidedeck][0], section)
+
+    def export(self, slidedeck, export_path, slides):
+        self.open(slidedeck)
+        presentation = self.presentations[slidedeck][0]
+        export_path = windows_path(export_path)
+        if slides is None:
+            logging.info(f"Exporting presentation to {export_path}")
+            presentation.Export(export_path, "png")
+            return
+        for index in slides:
+            logging.info(f"Exporting slide {index} to {export_path}")
+            presentation.Slides(index).Export(
+                os.path.join(export_path, f"Slide{index}.PNG"), "PNG")
+
+    def close(self, slidedeck):
+        presentation, opened = self.presentations.pop(slidedeck, (None, True))
+        if not opened:
             logging.debug("Closing presentation")
             presentation.Close()
-    if not powerpoint.Presentations.Count:
-        logging.debug("Closing powerpoint")
-        powerpoint.Quit()
+
+    def shutdown(self):
+        """Close PowerPoint, if no presentations are open."""
+        if self.powerpoint and not self.powerpoint.Presentations.Count:
+            logging.debug("Closing powerpoint")
+            self.powerpoint.Quit()
+        self.powerpoint = None
+
+
+class LibreOfficeBackend(Backend):
+    """Render slides using a pool of headless LibreOffice processes.
+
+    Every worker has its own user profile, so that the LibreOffice processes
+    don't block each other. Each worker converts a range of slides to PDF,
+    which is then rendered by pdftoppm (poppler-utils). The profiles are kept
+    until the backend is shut down.
+    """
+    concurrent = True
+
+    def __init__(self, options):
+        super().__init__(options)
+        self.workers = options["workers"] or os.cpu_count() or 1
+        self.temporary = tempfile.TemporaryDirectory(prefix=f"{__title__}-")
+        self.profiles = queue.Queue()
+        for worker in range(self.workers):
+            self.profiles.put(os.path.join(self.temporary.name, f"profile{worker}"))
+
+    def render(self, slidedeck, export_path, first, last):
+        """Render slide @first up to and including @last, or all slides if @first is None."""
+        profile = self.profiles.get()
+        try:
+            output = tempfile.mkdtemp(dir=self.temporary.name)
+            if not first:
+                logging.info(f"Exporting presentation to {export_path}")
+            elif first == last:
+                logging.info(f"Exporting slide {first} to {export_path}")
+            else:
+                logging.info(f"Exporting slides {first} to {last} to {export_path}")
+            # Hidden slides are exported as well, to keep the slide numbers
+            filter_options = {"ExportHiddenSlides": {"type": "boolean", "value": "true"}}
+            if first:
+                filter_options["PageRange"] = {"type": "string", "value": f"{first}-{last}"}
+            export_filter = "pdf:impress_pdf_Export:" + json.dumps(filter_options,
+                                                                   separators=(",", ":"))
+            execute_command([self.options["soffice"], "--headless", "--norestore",
+                             f"-env:UserInstallation={pathlib.Path(profile).as_uri()}",
+                             "--convert-to", export_filter, "--outdir", output, slidedeck])
+            document = os.path.join(output, os.path.splitext(
+                os.path.basename(slidedeck))[0] + ".pdf")
+            execute_command(["pdftoppm", "-png", "-r", str(RESOLUTION), document,
+                             os.path.join(output, "page")])
+            # pdftoppm pads the page numbers depending on the number of pages
+            pages = sorted(glob.glob(os.path.join(output, "page-*.png")),
+                           key=lambda page: int(page.rsplit("-", 1)[1][:-4]))
+            for index, page in enumerate(pages, first or 1):
+                os.replace(page, os.path.join(export_path, f"Slide{index}.PNG"))
+            rmtree(output, ignore_errors=True)
+        finally:
+            self.profiles.put(profile)
+
+    def export(self, slidedeck, export_path, slides):
+        runs = [(None, None)]
+        if slides is not None:
+            # Split the slides in (at least) one range of consecutive slides per worker
+            size = max(1, -(-len(slides) // self.workers))
+            runs = [run for first, last in slide_runs(slides)
+                    for run in [(index, min(index + size - 1, last))
+                                for index in range(first, last + 1, size)]]
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for future in [executor.submit(self.render, slidedeck, export_path, first, last)
+                           for first, last in runs]:
+                future.result()
+
+    def shutdown(self):
+        self.temporary.cleanup()
+
+
+class FakeBackend(Backend):
+    """Render placeholder slides in-process, for testing without an office suite."""
+    concurrent = True
+
+    def __init__(self, options):
+        super().__init__(options)
+        self.exported = []
+
+    @staticmethod
+    def placeholder(text):
+        """Return a blank grayscale PNG image of 160x90 pixels with comment @text."""
+        def chunk(kind, data):
+            """Return PNG chunk."""
+            return (struct.pack(">I", len(data)) + kind + data +
+                    struct.pack(">I", zlib.crc32(kind + data)))
+
+        pixels = b"".join(b"\0" + b"\xff" * 160 for _ in range(90))
+        return (b"\x89PNG\r\n\x1a\n" +
+                chunk(b"IHDR", struct.pack(">IIBBBBB", 160, 90, 8, 0, 0, 0, 0)) +
+                chunk(b"tEXt", b"Comment\0" + text.encode("latin-1", "replace")) +
+                chunk(b"IDAT", zlib.compress(pixels)) + chunk(b"IEND", b""))
+
+    def export(self, slidedeck, export_path, slides):
+        if slides is None:
+            with zipfile.ZipFile(slidedeck) as archive:
+                slides = range(1, len(read_index(archive)[0]) + 1)
+        for index in slides:
+            logging.debug(f"Exporting slide {index} to {export_path}")
+            with open(os.path.join(export_path, f"Slide{index}.PNG"), "wb") as output:
+                output.write(self.placeholder(f"{os.path.basename(slidedeck)} "
+                                              f"slide {index}"))
+            self.exported.append((slidedeck, index))
+
+
+BACKENDS = {"powerpoint": PowerPointBackend,
+            "libreoffice": LibreOfficeBackend,
+            "fake": FakeBackend}
+
+
+def read_batch(name):
+    """Return slidedecks in directory @name, or listed in manifest @name (one per line)."""
+    if os.path.isdir(name):
+        return sorted(os.path.join(name, filename) for filename in os.listdir(name)
+                      if filename.lower().endswith((".ppt", ".pptx")) and
+                      not filename.startswith("~$"))
+    try:
+        with open(name) as manifest:
+            lines = [line.strip() for line in manifest]
+    except OSError as exception:
+        raise ExportError(f"Could not read {name}: {exception}")
+    return [os.path.join(os.path.dirname(name), line) for line in lines
+            if line and not line.startswith("#")]
+
+
+def export_deck(slidedeck, export_path, copy, options, backend, cache, executor=None):
+    """Export, post-process (in process pool @executor) and publish slides of @slidedeck."""
+    slidedeck = windows_path(os.path.join(os.getcwd(), slidedeck))
+    export_path = windows_path(os.path.join(os.getcwd(), export_path))
+    check_file(slidedeck)
+    check_path(export_path)
+    name = os.path.basename(slidedeck)
+    start = time.time()
+    try:
+        index = deck_index(slidedeck, cache)
+        hashes = index["hashes"]
+        logging.info(f"Indexed {len(hashes)} slides in {time.time() - start:.3f} seconds")
+    except (KeyError, zipfile.BadZipFile, ElementTree.ParseError) as exception:
+        logging.info(f"Could not index slides, exporting all slides: {exception}")
+        index, hashes = None, None
+    try:
+        range_from, range_to = options["from"], options["to"] or options["from"]
+        if options["single"]:
+            range_from, range_to = options["single"], options["single"]
+        ranges = []
+        if range_from:
+            ranges.append((range_from, range_to, 0))
+        for section in [section for sections in options["section"] or []
+                        for section in sections]:
+            if index:
+                ranges.append(section_range(index, section) + (section,))
+            else:
+                ranges.append(backend.section_range(slidedeck, section) + (section,))
+        if hashes and any(first > len(hashes) for first, _, _ in ranges):
+            raise ExportError(f"This presentation only has {len(hashes)} slides")
+        manifest, slides = {}, None
+        if hashes is not None:
+            start = time.time()
+            if not options["force"]:
+                manifest = load_manifest(export_path, name)
+            requested = list(range(1, len(hashes) + 1))
+            if ranges:
+                requested = sorted(set(number for first, last, _ in ranges
+                                       for number in range(first, min(last, len(hashes)) + 1)))
+            slides = changed_slides(export_path, hashes, manifest, requested)
+            logging.info(f"{len(slides)} slides changed since the last export, compared in "
+                         f"{time.time() - start:.3f} seconds")
+        if slides is None or slides:
+            start = time.time()
+            # Remove previous images first, so that published hardlinks keep their contents
+            stale = glob.glob(os.path.join(export_path, "Slide*.PNG"))
+            if slides is not None:
+                stale = [os.path.join(export_path, f"Slide{number}.PNG") for number in slides]
+            for filename in stale:
+                if os.path.isfile(filename):
+                    os.remove(filename)
+            if slides is None or len(slides) == len(hashes):
+                backend.export(slidedeck, export_path, None)
+            else:
+                backend.export(slidedeck, export_path, slides)
+            for number in slides or []:
+                manifest[str(number)] = hashes[number - 1]
+            logging.info(f"Exported slides in {time.time() - start:.3f} seconds")
+            save_manifest(export_path, name, manifest)
+    finally:
+        backend.close(slidedeck)
+    if options["variant"]:
+        if hashes is None:
+            requested = sorted(int(os.path.basename(filename)[5:-4]) for filename in
+                               glob.glob(os.path.join(export_path, "Slide*.PNG")))
+        process_variants(export_path, options["variant"], requested, executor,
+                         options["workers"] or os.cpu_count() or 1)
+    if copy:
+        publish_slides(export_path, copy, ranges, options["workers"])
+
+
+def export_batch(slidedecks, options, backend, cache, executor=None):
+    """Export all @slidedecks through a queue of jobs, and return the failures.
+
+    Each slidedeck is exported into its own folder of the output path (and
+    copy folder), named after the slidedeck. Slidedecks whose names collide
+    are not exported, but reported as failures. Slidedecks are exported
+    concurrently when the backend supports it.
+    """
+    jobs = 1
+    if backend.concurrent:
+        jobs = options["jobs"] or options["workers"] or os.cpu_count() or 1
+    elif options["jobs"] and options["jobs"] > 1:
+        logging.info(f"The {options['backend']} backend exports one slidedeck at a time")
+    timings, failures = {}, {}
+    names, folders = {}, {}
+    for slidedeck in slidedecks:
+        names[slidedeck] = os.path.splitext(os.path.basename(slidedeck))[0]
+        # Folder names are compared case-insensitively, like most filesystems do
+        folders.setdefault(names[slidedeck].lower(), []).append(slidedeck)
+    for same in folders.values():
+        if len(same) > 1:
+            for slidedeck in same:
+                failures[slidedeck] = ExportError(f"Output folder {names[slidedeck]} is "
+                                                  f"shared by {', '.join(same)}")
+
+    def export(slidedeck):
+        """Export a single slidedeck, and record its timing or failure."""
+        name = names[slidedeck]
+        start = time.time()
+        try:
+            export_path = os.path.join(options["output"], name)
+            os.makedirs(export_path, exist_ok=True)
+            copy = None
+            if options["copy"]:
+                copy = os.path.join(options["copy"], name)
+                os.makedirs(copy, exist_ok=True)
+            export_deck(slidedeck, export_path, copy, options, backend, cache, executor)
+            timings[slidedeck] = time.time() - start
+        except Exception as exception:  # pylint: disable=broad-except
+            # One broken slidedeck shouldn't abort the rest of the batch
+            logging.debug(f"Exporting {slidedeck} failed", exc_info=True)
+            failures[slidedeck] = exception
+
+    start = time.time()
+    exportable = [slidedeck for slidedeck in slidedecks if slidedeck not in failures]
+    if jobs == 1:
+        for slidedeck in exportable:
+            export(slidedeck)
+    else:
+        with ThreadPoolExecutor(max_workers=jobs) as threads:
+            list(threads.map(export, exportable))
+    for slidedeck in slidedecks:
+        if slidedeck in timings:
+            logging.info(f"{slidedeck}: {timings[slidedeck]:.3f} seconds")
+    logging.info(f"Exported {len(timings)} of {len(slidedecks)} slidedecks in "
+                 f"{time.time() - start:.3f} seconds")
+    for slidedeck, exception in failures.items():
+        logging.error(f"Could not export {slidedeck}: {exception}")
+    return failures
 
 
 def main():
@@ -201,27 +923,41 @@ def main():
     banner = f"{__title__} version {__version__}"
     options = parse_arguments(banner)
     setup_logging(options)
-    slidedeck = windows_path(os.path.join(os.getcwd(), options['slides']))
-    export_path = windows_path(os.path.join(os.getcwd(), options['output']))
-    check_file(slidedeck)
-    check_path(export_path)
-    name, path = os.path.basename(slidedeck), os.path.dirname(slidedeck)
-    powerpoint = get_powerpoint()
-    presentation, opened = get_presentation(powerpoint, path, name)
-    logging.info(f"Exporting presentation to {export_path}")
-    presentation.Export(export_path, "png")
-    if options["from"]:
-        range_from = options["from"]
-        if not options["to"]:
-            range_to = range_from
-    section = 0
-    if options["section"]:
-        section = options["section"]
-        range_from, range_to = get_section_range(presentation, section)
-    if not opened:
-        close_presentation(powerpoint, name)
-    if options["copy"]:
-        copy_slides(export_path, options["copy"], range_from, range_to, section)
+    if options["variant"] and not Image:
+        logging.error("Please install Pillow to create image variants")
+        sys.exit(-1)
+    if options["copy"] and not (options["from"] or options["single"] or options["section"]):
+        logging.error("Specify a slide range or section to copy")
+        sys.exit(-1)
+    cache = {}
+    if options["cache"]:
+        cache = load_cache(options["cache"])
+    original = dict(cache)
+    executor = None
+    if options["variant"]:
+        # One pool for all slidedecks; spawned, as the backends and batches use threads
+        executor = ProcessPoolExecutor(max_workers=options["workers"] or os.cpu_count() or 1,
+                                       mp_context=multiprocessing.get_context("spawn"))
+    backend = BACKENDS[options["backend"]](options)
+    failed = False
+    try:
+        if options["batch"]:
+            failed = bool(export_batch(read_batch(options["slides"]), options, backend, cache,
+                                       executor))
+        else:
+            export_deck(options["slides"], options["output"], options["copy"], options,
+                        backend, cache, executor)
+    except ExportError as exception:
+        logging.error(exception)
+        failed = True
+    finally:
+        backend.shutdown()
+        if executor:
+            executor.shutdown()
+        if options["cache"] and cache != original:
+            save_cache(options["cache"], cache)
+    if failed:
+        sys.exit(-1)
 
 
 if __name__ == "__main__":
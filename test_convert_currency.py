@@ -0,0 +1,59 @@
+"""Tests for convert_currency: calculate_fees_array must equal calculate_fees."""
+
+import random
+import sys
+
+import pytest
+
+import convert_currency
+
+FEES = [0.5, 2.5, 50, 100, 102.5, 200]
+
+
+def random_amounts():
+    """Return random amounts of different magnitudes."""
+    generator = random.Random(0)
+    return ([generator.uniform(0, 100000) for _ in range(5000)] +
+            [generator.uniform(0, 1) for _ in range(1000)] +
+            [round(generator.uniform(0, 1000), 3) for _ in range(1000)])
+
+
+def halfway_amounts():
+    """Return amounts whose fees lie (almost) exactly halfway between two cents."""
+    return [(cents * 10 + 5) / 1000.0 for cents in range(0, 100000, 7)] + \
+        [0.125, 0.375, 2.675, 1.005, 1.015, 1.025, 0.285, 1234567.895]
+
+
+def edge_amounts():
+    """Return negative, large and tiny amounts."""
+    return [-amount for amount in halfway_amounts()] + \
+        [0.0, -0.0, 5e-324, 1e-300, 4.5e13 + 0.125, 1e15 + 0.5, 2.0 ** 53, 1e300,
+         float('inf'), float('-inf')]
+
+
+def expected_fees(amounts, fee, decimals):
+    """Return fees calculated one by one using calculate_fees."""
+    fees = [convert_currency.calculate_fees(amount, fee, decimals) for amount in amounts]
+    return [item[0] for item in fees], [item[1] for item in fees]
+
+
+@pytest.fixture(params=['numpy', 'python'])
+def implementation(request, monkeypatch):
+    """Run the test with and without NumPy."""
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setitem(sys.modules, 'numpy', None)
+    return request.param
+
+
+@pytest.mark.parametrize('amounts', [random_amounts(), halfway_amounts(), edge_amounts()],
+                         ids=['random', 'halfway', 'edge'])
+@pytest.mark.parametrize('decimals', [0, 2])
+@pytest.mark.parametrize('fee', FEES)
+def test_calculate_fees_array(implementation, amounts, fee, decimals):
+    """Both paths return exactly the same values as calculate_fees."""
+    add_fee, subtract_fee = convert_currency.calculate_fees_array(amounts, fee, decimals)
+    expected_add, expected_subtract = expected_fees(amounts, fee, decimals)
+    assert list(add_fee) == expected_add, implementation
+    assert list(subtract_fee) == expected_subtract, implementation
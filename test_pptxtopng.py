@@ -0,0 +1,205 @@
+"""Tests for pptxtopng: exporting slidedecks through the fake backend."""
+
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+import pptxtopng
+
+NAMESPACES = pptxtopng.NAMESPACES
+RELATIONSHIP = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+
+
+def relationships(targets):
+    """Return relationships part of (type, target) @targets."""
+    items = "".join(f'<Relationship Id="rId{number}" Type="{RELATIONSHIP}/{kind}" '
+                    f'Target="{target}"/>' for number, (kind, target) in enumerate(targets, 1))
+    return f'<Relationships xmlns="{NAMESPACES["rel"]}">{items}</Relationships>'
+
+
+def make_deck(filename, slides, sections=None, layout="layout", notes=None):
+    """Write slidedeck @filename with the contents of @slides, sharing one layout.
+
+    @sections is a list of (name, slide numbers), @notes a dictionary of
+    slide number => notes.
+    """
+    notes = notes or {}
+    section_list = ""
+    if sections:
+        section_list = "".join(
+            f'<p14:section name="{name}"><p14:sldIdLst>' +
+            "".join(f'<p14:sldId id="{255 + number}"/>' for number in numbers) +
+            "</p14:sldIdLst></p14:section>" for name, numbers in sections)
+        section_list = (f'<p:extLst><p:ext><p14:sectionLst xmlns:p14="{NAMESPACES["p14"]}">'
+                        f"{section_list}</p14:sectionLst></p:ext></p:extLst>")
+    slide_ids = "".join(f'<p:sldId id="{255 + number}" r:id="rId{number}"/>'
+                        for number in range(1, len(slides) + 1))
+    with zipfile.ZipFile(filename, "w") as archive:
+        archive.writestr("ppt/presentation.xml",
+                         f'<p:presentation xmlns:p="{NAMESPACES["p"]}" '
+                         f'xmlns:r="{NAMESPACES["r"]}"><p:sldIdLst>{slide_ids}</p:sldIdLst>'
+                         f"{section_list}</p:presentation>")
+        archive.writestr("ppt/_rels/presentation.xml.rels",
+                         relationships([("slide", f"slides/slide{number}.xml")
+                                        for number in range(1, len(slides) + 1)]))
+        archive.writestr("ppt/slideLayouts/slideLayout1.xml", layout)
+        for number, content in enumerate(slides, 1):
+            archive.writestr(f"ppt/slides/slide{number}.xml", content)
+            targets = [("slideLayout", "../slideLayouts/slideLayout1.xml")]
+            if number in notes:
+                targets.append(("notesSlide", f"../notesSlides/notesSlide{number}.xml"))
+                archive.writestr(f"ppt/notesSlides/notesSlide{number}.xml", notes[number])
+            archive.writestr(f"ppt/slides/_rels/slide{number}.xml.rels",
+                             relationships(targets))
+    # Make sure the cached index of a rewritten slidedeck is never used
+    stat = os.stat(filename)
+    os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + make_deck.counter))
+    make_deck.counter += 1000
+
+
+make_deck.counter = 1000
+
+
+def make_options(**overrides):
+    """Return export options, with @overrides."""
+    options = {"from": None, "to": None, "single": None, "section": None, "force": False,
+               "variant": None, "workers": 2, "jobs": None, "copy": None,
+               "backend": "fake", "output": None}
+    options.update(overrides)
+    return options
+
+
+def export(slidedeck, export_path, copy=None, cache=None, executor=None, **overrides):
+    """Export @slidedeck with the fake backend and return the exported slide numbers."""
+    options = make_options(**overrides)
+    backend = pptxtopng.FakeBackend(options)
+    pptxtopng.export_deck(str(slidedeck), str(export_path), copy and str(copy), options,
+                          backend, {} if cache is None else cache, executor)
+    return sorted(index for _, index in backend.exported)
+
+
+def slide_files(path):
+    """Return sorted names of the exported slides in @path."""
+    return sorted(name for name in os.listdir(path) if name.startswith("Slide"))
+
+
+def test_export_all_slides(tmp_path):
+    """All slides are exported and recorded in the manifest."""
+    make_deck(tmp_path / "deck.pptx", ["a", "b", "c"])
+    (tmp_path / "out").mkdir()
+    assert export(tmp_path / "deck.pptx", tmp_path / "out") == [1, 2, 3]
+    assert slide_files(tmp_path / "out") == ["Slide1.PNG", "Slide2.PNG", "Slide3.PNG"]
+    manifest = pptxtopng.load_manifest(str(tmp_path / "out"), "deck.pptx")
+    assert sorted(manifest) == ["1", "2", "3"]
+
+
+def test_incremental_export(tmp_path):
+    """Only slides whose content (or parts they use) changed are exported again."""
+    deck, output, cache = tmp_path / "deck.pptx", tmp_path / "out", {}
+    output.mkdir()
+    make_deck(deck, ["a", "b", "c"], notes={2: "notes"})
+    assert export(deck, output, cache=cache) == [1, 2, 3]
+    assert export(deck, output, cache=cache) == []
+    make_deck(deck, ["a", "changed", "c"], notes={2: "notes"})
+    assert export(deck, output, cache=cache) == [2]
+    make_deck(deck, ["a", "changed", "c"], notes={2: "other notes"})
+    assert export(deck, output, cache=cache) == []
+    make_deck(deck, ["a", "changed", "c"], layout="new layout", notes={2: "other notes"})
+    assert export(deck, output, cache=cache) == [1, 2, 3]
+    os.remove(output / "Slide3.PNG")
+    assert export(deck, output, cache=cache) == [3]
+    assert export(deck, output, cache=cache, force=True) == [1, 2, 3]
+
+
+def test_section_ranges(tmp_path):
+    """Sections are read from the slidedeck, and only their slides are exported."""
+    deck, output, copy = tmp_path / "deck.pptx", tmp_path / "out", tmp_path / "copy"
+    output.mkdir()
+    copy.mkdir()
+    make_deck(deck, ["a", "b", "c", "d", "e"],
+              sections=[("Intro", [1, 2]), ("Main", [3, 4, 5]), ("Empty", [])])
+    assert export(deck, output, copy, section=[[2]]) == [3, 4, 5]
+    assert slide_files(copy) == ["Slide2-01.png", "Slide2-02.png", "Slide2-03.png"]
+    with pytest.raises(pptxtopng.ExportError, match="only has 3 sections"):
+        export(deck, output, copy, section=[[4]])
+    with pytest.raises(pptxtopng.ExportError, match="doesn't contain any slides"):
+        export(deck, output, copy, section=[[3]])
+
+
+def test_publish_hardlinks(tmp_path):
+    """Published slides are hardlinked, and keep their contents on a new export."""
+    deck, output, copy = tmp_path / "deck.pptx", tmp_path / "out", tmp_path / "copy"
+    output.mkdir()
+    copy.mkdir()
+    make_deck(deck, ["a", "b", "c"])
+    export(deck, output, copy, **{"from": 2, "to": 3})
+    assert os.path.samefile(output / "Slide2.PNG", copy / "Slide0-01.png")
+    published = (copy / "Slide0-02.png").read_bytes()
+    make_deck(deck, ["a", "b", "changed"])
+    export(deck, output, single=3)
+    assert (copy / "Slide0-02.png").read_bytes() == published
+    assert not os.path.samefile(output / "Slide3.PNG", copy / "Slide0-02.png")
+    export(deck, output, copy, single=3)
+    assert os.path.samefile(output / "Slide3.PNG", copy / "Slide0-01.png")
+
+
+def test_variants(tmp_path):
+    """Variants are created once, and again when their slide changed."""
+    image = pytest.importorskip("PIL.Image")
+    deck, output = tmp_path / "deck.pptx", tmp_path / "out"
+    output.mkdir()
+    make_deck(deck, ["a", "b"])
+    variants = [pptxtopng.parse_variant("small:40:png"), pptxtopng.parse_variant("web:-:webp")]
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        export(deck, output, executor=executor, variant=variants)
+        with image.open(output / "small" / "Slide1.png") as small:
+            assert small.width == 40
+        assert sorted(os.listdir(output / "web")) == ["Slide1.webp", "Slide2.webp"]
+        created = dict((name, os.stat(output / "small" / name).st_mtime_ns)
+                       for name in os.listdir(output / "small"))
+        export(deck, output, executor=executor, variant=variants)
+        assert created == dict((name, os.stat(output / "small" / name).st_mtime_ns)
+                               for name in os.listdir(output / "small"))
+        make_deck(deck, ["a", "changed"])
+        export(deck, output, executor=executor, variant=variants)
+        assert created["Slide1.png"] == os.stat(output / "small" / "Slide1.png").st_mtime_ns
+        assert created["Slide2.png"] != os.stat(output / "small" / "Slide2.png").st_mtime_ns
+
+
+def test_batch_failures(tmp_path):
+    """Broken slidedecks are reported as failures, without stopping the batch."""
+    batch, output = tmp_path / "batch", tmp_path / "out"
+    batch.mkdir()
+    output.mkdir()
+    make_deck(batch / "first.pptx", ["a", "b"])
+    make_deck(batch / "second.pptx", ["c"])
+    (batch / "junk.pptx").write_bytes(b"junk")
+    with zipfile.ZipFile(batch / "empty.pptx", "w") as archive:
+        archive.writestr("other.xml", "")
+    options = make_options(output=str(output), jobs=2)
+    failures = pptxtopng.export_batch(pptxtopng.read_batch(str(batch)), options,
+                                      pptxtopng.FakeBackend(options), {})
+    assert sorted(os.path.basename(slidedeck) for slidedeck in failures) == \
+        ["empty.pptx", "junk.pptx"]
+    assert slide_files(output / "first") == ["Slide1.PNG", "Slide2.PNG"]
+    assert slide_files(output / "second") == ["Slide1.PNG"]
+
+
+def test_batch_name_collision(tmp_path):
+    """Slidedecks that would share an output folder are not exported."""
+    output = tmp_path / "out"
+    for folder in ["one", "two", "out"]:
+        (tmp_path / folder).mkdir()
+    make_deck(tmp_path / "one" / "deck.pptx", ["a"])
+    make_deck(tmp_path / "one" / "other.pptx", ["b"])
+    make_deck(tmp_path / "two" / "Deck.pptx", ["c"])
+    (tmp_path / "batch.txt").write_text("one/deck.pptx\ntwo/Deck.pptx\none/other.pptx\n")
+    options = make_options(output=str(output), jobs=2)
+    failures = pptxtopng.export_batch(pptxtopng.read_batch(str(tmp_path / "batch.txt")),
+                                      options, pptxtopng.FakeBackend(options), {})
+    assert sorted(os.path.relpath(slidedeck, tmp_path) for slidedeck in failures) == \
+        [os.path.join("one", "deck.pptx"), os.path.join("two", "Deck.pptx")]
+    assert all("shared by" in str(exception) for exception in failures.values())
+    assert sorted(os.listdir(output)) == ["other"]
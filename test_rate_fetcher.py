@@ -0,0 +1,120 @@
+"""Tests for convert_currency.AsyncRateFetcher, against a local HTTP stub."""
+
+from datetime import datetime, timedelta
+import http.server
+import json
+import threading
+import time
+
+import pytest
+
+import convert_currency
+
+DATES = [datetime(2018, 2, 1) + timedelta(days=day) for day in range(20)]
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    """Answer rate requests, failing with the statuses scripted per date."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def handle(self):
+        with self.server.lock:
+            self.server.connections += 1
+        super().handle()
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Return the rate table (or a scripted failure) for the requested date."""
+        date = self.path.split('?')[0].rsplit('/', 1)[-1]
+        server = self.server
+        with server.lock:
+            server.requests.append(date)
+            server.active += 1
+            server.peak = max(server.peak, server.active)
+            failures = server.failures.get(date, [])
+            status = failures.pop(0) if failures else 200
+        time.sleep(server.delay)
+        with server.lock:
+            server.active -= 1
+        body = json.dumps({'base': 'EUR', 'date': date, 'rates': {'USD': 1.25}}).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+@pytest.fixture
+def stub():
+    """Run the stub rate provider in a background thread."""
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.requests, server.failures = [], {}
+    server.connections, server.active, server.peak = 0, 0, 0
+    server.delay = 0.02
+    thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.01},
+                              daemon=True)
+    thread.start()
+    server.url = 'http://127.0.0.1:{0}/api/'.format(server.server_address[1])
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def fetcher(stub, concurrency=4, retries=3):
+    """Return a fetcher for the stub, without noticeable backoff."""
+    return convert_currency.AsyncRateFetcher(stub.url, concurrency=concurrency,
+                                             retries=retries, backoff=0.001, timeout=5)
+
+
+def test_fetch_all_dates(stub):
+    """Every date is fetched exactly once."""
+    results = fetcher(stub).fetch_rates('EUR', DATES)
+    assert results == dict((date, {'USD': 1.25}) for date in DATES)
+    assert sorted(stub.requests) == [convert_currency.date_key(date) for date in DATES]
+
+
+def test_concurrency_bound(stub):
+    """At most concurrency requests are in flight, but more than one."""
+    fetcher(stub, concurrency=4).fetch_rates('EUR', DATES)
+    assert 1 < stub.peak <= 4
+
+
+def test_connection_reuse(stub):
+    """Requests reuse the keep-alive connections, one per concurrent request."""
+    fetcher(stub, concurrency=4).fetch_rates('EUR', DATES)
+    assert len(stub.requests) == len(DATES)
+    assert stub.connections <= 4
+
+
+@pytest.mark.parametrize('status', [503, 429])
+def test_retry(stub, status):
+    """Server errors and rate limiting are retried until the request succeeds."""
+    key = convert_currency.date_key(DATES[0])
+    stub.failures[key] = [status, status]
+    assert fetcher(stub).get_rates('EUR', DATES[0]) == {'USD': 1.25}
+    assert stub.requests.count(key) == 3
+    assert stub.connections == 1
+
+
+def test_retries_exhausted(stub):
+    """After the last retry the date is reported as not available."""
+    key = convert_currency.date_key(DATES[0])
+    stub.failures[key] = [503] * 5
+    results = fetcher(stub, retries=2).fetch_rates('EUR', DATES[:2])
+    assert isinstance(results[DATES[0]], convert_currency.RatesNotAvailableError)
+    assert results[DATES[1]] == {'USD': 1.25}
+    assert stub.requests.count(key) == 3
+
+
+def test_client_error_is_not_retried(stub):
+    """Client errors (other than 429) fail immediately."""
+    key = convert_currency.date_key(DATES[0])
+    stub.failures[key] = [404]
+    with pytest.raises(convert_currency.RatesNotAvailableError):
+        fetcher(stub).get_rates('EUR', DATES[0])
+    assert stub.requests.count(key) == 1
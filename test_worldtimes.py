@@ -0,0 +1,57 @@
+"""Tests for worldtimes: start-up must not load the timezone and terminal libraries,
+and invalid options are rejected."""
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+WORLDTIMES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'worldtimes.py')
+HEAVY = ['pytz', 'colorama', 'termcolor']
+# Generous bound, well above a cold import of worldtimes itself
+MAX_SECONDS = 0.25
+
+MEASURE = '''
+import json, os, runpy, sys, time
+sys.path.insert(0, os.path.dirname({path!r}))
+start = time.perf_counter()
+try:
+    {statement}
+except SystemExit:
+    pass
+elapsed = time.perf_counter() - start
+sys.stderr.write(json.dumps({{'elapsed': elapsed,
+                              'loaded': [name for name in {heavy!r} if name in sys.modules]}}))
+'''
+
+
+def measure(statement):
+    """Run @statement in a fresh interpreter, and return its duration and loaded libraries."""
+    process = subprocess.run([sys.executable, '-c', MEASURE.format(path=WORLDTIMES,
+                                                                   statement=statement,
+                                                                   heavy=HEAVY)],
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    return json.loads(process.stderr.decode('utf-8').splitlines()[-1])
+
+
+@pytest.mark.parametrize('statement', [
+    'import worldtimes',
+    "sys.argv = [{0!r}, '--list']; runpy.run_path({0!r}, run_name='__main__')".format(WORLDTIMES),
+], ids=['import', 'list'])
+def test_start_up(statement):
+    """Importing and listing zones don't load pytz, colorama or termcolor, and are fast."""
+    result = min((measure(statement) for _ in range(3)), key=lambda result: result['elapsed'])
+    assert result['loaded'] == []
+    assert result['elapsed'] < MAX_SECONDS
+
+
+@pytest.mark.parametrize('option', ['--interval', '--step', '--plan'])
+@pytest.mark.parametrize('value', ['0', '-1', 'x'])
+def test_reject_non_positive(option, value):
+    """Options that are used as divisor or step only accept positive numbers."""
+    process = subprocess.run([sys.executable, WORLDTIMES, option, value],
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    assert process.returncode == 2
+    assert 'argument {0}:'.format(option).encode('utf-8') in process.stderr
@@ -16,50 +16,451 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import argparse
-from datetime import datetime
+from array import array
+from bisect import bisect_right
+import calendar
+import csv
+from datetime import datetime, timedelta
+import difflib
+import functools
+import importlib
+import json
+import os
 import sys
 import textwrap
+import time
 
 try:
-    import colorama
-    import pytz
-    import termcolor
-    import tzlocal
-except ImportError as exception:
-    print('Please install all required libraries (see requirements.txt): {0}'.format(exception),
-          file=sys.stderr)
-    sys.exit(-1)
+    unicode
+except NameError:  # Python 3
+    unicode = str  # pylint: disable=invalid-name,redefined-builtin
 
 VERSION = '0.8'
 DEFAULT_TIMEZONES = ['Australia/Sydney', 'Australia/Brisbane',
                      'Asia/Kuala_Lumpur', 'Asia/Singapore',
                      'Europe/Amsterdam', 'UTC', 'America/Chicago',
                      'US/Mountain']
+EPOCH = datetime(1970, 1, 1)
+ZONE_INDEX = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'worldtimes_zones.json')
+ZONE_TABLES = {}
 
 
-def display_times(timezone_times, from_timezone, to_timezone):
-    """Display times in each timezone."""
-    colorama.init()
-    for timezone, timestring in timezone_times:
-        if timezone.lower() == unicode(from_timezone).lower():
-            termcolor.cprint('{0:20} {1}'.format(timezone, timestring),
-                             'green', attrs=['bold'])
-        elif timezone.lower() == unicode(to_timezone).lower():
-            termcolor.cprint('{0:20} {1}'.format(timezone, timestring),
-                             attrs=['bold'])
+def library(name, required=True):
+    """Import and return library @name on first use.
+
+    Libraries are only loaded when a code path needs them, which keeps start-up
+    fast. Exits when a required library is missing, otherwise returns None.
+    """
+    try:
+        return importlib.import_module(name)
+    except ImportError as exception:
+        if not required:
+            return None
+        print('Please install all required libraries (see requirements.txt): {0}'.
+              format(exception), file=sys.stderr)
+        sys.exit(-1)
+
+
+class ZoneTable(object):
+    """Compact table of UTC transition instants and offsets of one timezone.
+
+    Instants are expressed in seconds since the epoch. Converting an instant
+    to local time is a binary search in the transition table, which can be
+    done for a whole array of instants at once when NumPy is available.
+    """
+
+    def __init__(self, name, timezone):
+        self.name = name
+        # pylint: disable=protected-access
+        transitions = getattr(timezone, '_utc_transition_times', None)
+        if transitions:
+            self.transitions = array('q', [epoch_seconds(instant) for instant in transitions])
+            self.offsets = array('l', [int(info[0].total_seconds())
+                                       for info in timezone._transition_info])
+            self.abbreviations = [info[2] for info in timezone._transition_info]
         else:
+            self.transitions = array('q', [epoch_seconds(datetime.min)])
+            self.offsets = array('l', [int(timezone.utcoffset(None).total_seconds())])
+            self.abbreviations = [timezone.tzname(None)]
+        self.offset_strings = [format_offset(offset) for offset in self.offsets]
+
+    def index(self, epoch):
+        """Return index of the transition that applies to @epoch."""
+        return max(bisect_right(self.transitions, epoch) - 1, 0)
+
+    def next_transition(self, epoch):
+        """Return the first transition after @epoch, or None."""
+        index = bisect_right(self.transitions, epoch)
+        if index < len(self.transitions):
+            return self.transitions[index]
+        return None
+
+    def utcoffset(self, epoch):
+        """Return UTC offset in seconds at @epoch."""
+        return self.offsets[self.index(epoch)]
+
+    def strftime(self, epoch):
+        """Return @epoch as '%z %Y-%m-%d %H:%M %Z' in this timezone."""
+        index = self.index(epoch)
+        local = EPOCH + timedelta(seconds=epoch + self.offsets[index])
+        return '{0} {1:%Y-%m-%d %H:%M} {2}'.format(self.offset_strings[index], local,
+                                                   self.abbreviations[index])
+
+    def isoformat(self, epoch):
+        """Return @epoch as ISO 8601 local time with UTC offset in this timezone."""
+        index = self.index(epoch)
+        offset = self.offset_strings[index]
+        local = EPOCH + timedelta(seconds=epoch + self.offsets[index])
+        return '{0}{1}:{2}'.format(local.isoformat(), offset[:3], offset[3:])
+
+    def convert(self, epochs):
+        """Return local instants and transition indices for all @epochs.
+
+        Returns NumPy arrays when NumPy is available, otherwise lists.
+        """
+        numpy = library('numpy', required=False)
+        if numpy is None:
+            indices = [self.index(epoch) for epoch in epochs]
+            return [epoch + self.offsets[index] for epoch, index in zip(epochs, indices)], \
+                indices
+        epochs = numpy.asarray(epochs, dtype=numpy.int64)
+        indices = numpy.searchsorted(numpy.frombuffer(self.transitions, dtype=numpy.int64),
+                                     epochs, side='right') - 1
+        numpy.clip(indices, 0, None, out=indices)
+        return epochs + numpy.asarray(self.offsets, dtype=numpy.int64)[indices], indices
+
+
+def epoch_seconds(instant):
+    """Return seconds since the epoch for naive UTC or aware @instant."""
+    return calendar.timegm(instant.utctimetuple())
+
+
+def format_offset(offset):
+    """Return @offset in seconds as +HHMM."""
+    sign = '-' if offset < 0 else '+'
+    minutes = abs(offset) // 60
+    return '{0}{1:02}{2:02}'.format(sign, minutes // 60, minutes % 60)
+
+
+def zone_table(name):
+    """Return (cached) ZoneTable of timezone @name."""
+    if name not in ZONE_TABLES:
+        ZONE_TABLES[name] = ZoneTable(name, get_timezone(name))
+    return ZONE_TABLES[name]
+
+
+def convert_instants(epochs, zones):
+    """Return dictionary of zone => local instants for all @epochs in all @zones."""
+    return dict((zone, zone_table(zone).convert(epochs)[0]) for zone in zones)
+
+
+def colorize(termcolor, line, timezone, from_timezone, to_timezone):
+    """Return @line highlighted when @timezone is the source or target timezone."""
+    if timezone == from_timezone:
+        return termcolor.colored(line, 'green', attrs=['bold'])
+    if timezone == to_timezone:
+        return termcolor.colored(line, attrs=['bold'])
+    return line
+
+
+def display_times(timezone_times, from_timezone, to_timezone):
+    """Display times in each timezone, highlighted when output is a terminal."""
+    if not sys.stdout.isatty():
+        for timezone, timestring in timezone_times:
             print('{0:20} {1}'.format(timezone, timestring))
+        return
+    library('colorama').init()
+    termcolor = library('termcolor')
+    from_timezone, to_timezone = unicode(from_timezone), unicode(to_timezone)
+    for timezone, timestring in timezone_times:
+        print(colorize(termcolor, '{0:20} {1}'.format(timezone, timestring), timezone,
+                       from_timezone, to_timezone))
+
+
+class LiveZone(object):  # pylint: disable=too-few-public-methods
+    """Clock of one timezone, which only looks up its UTC offset after a transition."""
+
+    def __init__(self, zone):
+        self.zone = zone
+        self.table = zone_table(zone)
+        self.index = 0
+        self.valid_from = float('inf')
+        self.valid_until = float('-inf')
+
+    def line(self, epoch):
+        """Return display line of this timezone at @epoch."""
+        if not self.valid_from <= epoch < self.valid_until:
+            self.index = self.table.index(epoch)
+            self.valid_from = self.table.transitions[self.index]
+            self.valid_until = self.table.next_transition(epoch) or float('inf')
+        local = EPOCH + timedelta(seconds=epoch + self.table.offsets[self.index])
+        return '{0:20} {1} {2:%Y-%m-%d %H:%M} {3}'.format(self.zone,
+                                                          self.table.offset_strings[self.index],
+                                                          local,
+                                                          self.table.abbreviations[self.index])
+
+
+def live_times(zones, from_timezone, to_timezone, interval):
+    """Keep displaying times in each timezone, redrawing only lines that changed."""
+    if not sys.stdout.isatty():
+        print('Live mode needs a terminal', file=sys.stderr)
+        sys.exit(-1)
+    library('colorama').init()
+    termcolor = library('termcolor')
+    from_timezone, to_timezone = unicode(from_timezone), unicode(to_timezone)
+    clocks = [LiveZone(zone) for zone in zones]
+    shown = [None] * len(clocks)
+    sys.stdout.write('\n' * len(clocks) + '\033[?25l')  # Reserve lines, hide cursor
+    try:
+        while True:
+            epoch = int(time.time())
+            for row, clock in enumerate(clocks):
+                line = clock.line(epoch)
+                if line != shown[row]:
+                    shown[row] = line
+                    up = len(clocks) - row
+                    sys.stdout.write('\033[{0}A\r\033[2K{1}\033[{0}B\r'.format(
+                        up, colorize(termcolor, line, clock.zone, from_timezone,
+                                     to_timezone)))
+            sys.stdout.flush()
+            time.sleep(interval - time.time() % interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sys.stdout.write('\033[?25h')
+        sys.stdout.flush()
+
+
+def load_zone_index():
+    """Return the precompiled zone name index, or build it when it is not available."""
+    try:
+        with open(ZONE_INDEX) as index:
+            return json.load(index)
+    except (IOError, ValueError):
+        return build_zone_index()
+
+
+def build_zone_index(filename=None):
+    """Return index of all zone names and zones per country, and optionally save it."""
+    pytz = library('pytz')
+    index = {'pytz': pytz.__version__,
+             'zones': list(pytz.all_timezones),
+             'countries': dict((country, list(pytz.country_timezones[country]))
+                               for country in pytz.country_timezones)}
+    if filename:
+        with open(filename, 'w') as output:
+            json.dump(index, output, indent=0, sort_keys=True)
+    return index
 
 
 def list_countries(country):
     """List available country codes and exit."""
     try:
-        print(' '.join(pytz.country_timezones[country]))
+        print(' '.join(load_zone_index()['countries'][country.upper()]))
     except KeyError as exception:
         print('Could not find country: {0}'.format(exception), file=sys.stderr)
     sys.exit(0)
 
 
+@functools.lru_cache(maxsize=1)
+def zone_aliases():
+    """Return case-insensitive index of alias => zone name, built once.
+
+    Besides all zone names (including links like US/Mountain), the index
+    contains city names ('new york' and 'new_york' for America/New_York) and
+    country codes of countries with a single timezone.
+    """
+    index = load_zone_index()
+    if index['pytz'] != library('pytz').__version__:
+        # The precompiled index belongs to another version of pytz
+        index = build_zone_index()
+    aliases = {}
+    cities = {}
+    for zone in index['zones']:
+        city = zone.split('/')[-1].lower()
+        cities.setdefault(city, set()).add(zone)
+        cities.setdefault(city.replace('_', ' '), set()).add(zone)
+    for city, zones in cities.items():
+        if len(zones) == 1:
+            aliases[city] = zones.pop()
+    for country, zones in index['countries'].items():
+        if len(zones) == 1:
+            aliases[country.lower()] = zones[0]
+    for zone in index['zones']:
+        aliases[zone.lower()] = zone
+    return aliases
+
+
+def suggest_zones(name, count=3):
+    """Return up to @count zone names that resemble @name."""
+    aliases = zone_aliases()
+    return sorted(set(aliases[match] for match in
+                      difflib.get_close_matches(name.lower(), aliases, n=count)))
+
+
+@functools.lru_cache(maxsize=1024)
+def resolve_zone(name):
+    """Return zone name for (case-insensitive) zone name or alias @name.
+
+    Raises ValueError, including suggestions, when @name cannot be resolved.
+    """
+    try:
+        return zone_aliases()[name.strip().lower()]
+    except KeyError:
+        suggestions = suggest_zones(name)
+        if suggestions:
+            raise ValueError('Unknown timezone: {0} (did you mean {1}?)'.
+                             format(name, ', '.join(suggestions)))
+        raise ValueError('Unknown timezone: {0}'.format(name))
+
+
+def get_timezone(name):
+    """Return pytz timezone for (case-insensitive) zone name or alias @name.
+
+    Raises ValueError when @name cannot be resolved.
+    """
+    pytz = library('pytz')
+    try:
+        return pytz.timezone(resolve_zone(name))
+    except pytz.UnknownTimeZoneError:
+        raise ValueError('Unknown timezone: {0}'.format(name))
+
+
+def parse_instant(value, timezone):
+    """Return seconds since the epoch of ISO 8601 or epoch @value.
+
+    ISO 8601 values without UTC offset are interpreted in @timezone.
+    """
+    value = value.strip()
+    try:
+        return int(float(value))
+    except ValueError:
+        pass
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    instant = datetime.fromisoformat(value)
+    if instant.tzinfo is None:
+        if hasattr(timezone, 'localize'):
+            instant = timezone.localize(instant)
+        else:
+            instant = instant.replace(tzinfo=timezone)
+    return epoch_seconds(instant)
+
+
+def convert_stream(source, destination, zones, timezone, fmt):
+    """Convert all instants (one per line) from @source to @zones, and write to @destination.
+
+    Instants are read, converted and written one at a time, so memory use stays
+    constant. The zone tables are resolved only once.
+    """
+    tables = [zone_table(zone) for zone in zones]
+    if fmt == 'csv':
+        writer = csv.writer(destination, lineterminator='\n')
+        writer.writerow(['instant'] + list(zones))
+    for line in source:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            epoch = parse_instant(line, timezone)
+            row = [table.isoformat(epoch) for table in tables]
+        except (OSError, OverflowError, ValueError) as exception:
+            print('Could not convert time {0}: {1}'.format(line, exception), file=sys.stderr)
+            continue
+        if fmt == 'csv':
+            writer.writerow([line] + row)
+        else:
+            record = dict(zip(zones, row))
+            record['instant'] = line
+            destination.write(json.dumps(record) + '\n')
+
+
+def parse_hours(value):
+    """Parse working hours HH[:MM]-HH[:MM] into seconds since midnight."""
+    try:
+        hours = []
+        for item in value.split('-'):
+            hour, _, minute = item.partition(':')
+            hours.append(int(hour) * 3600 + int(minute or 0) * 60)
+        start, end = hours
+    except ValueError:
+        raise argparse.ArgumentTypeError('Working hours must be in the form HH:MM-HH:MM')
+    if not 0 <= start < end <= 86400:
+        raise argparse.ArgumentTypeError('Working hours must be within one day')
+    return start, end
+
+
+def positive_int(value):
+    """Parse a whole number that is greater than zero."""
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError('{0} is not a whole number'.format(value))
+    if number < 1:
+        raise argparse.ArgumentTypeError('{0} must be greater than zero'.format(value))
+    return number
+
+
+def working_mask(zones, grid, hours, weekdays):
+    """Return for every instant in @grid whether it is within working hours in all @zones.
+
+    Each zone is converted in one batched pass over the whole grid, using the
+    transition tables, so DST transitions within the grid are taken into
+    account. Weekdays are numbered from Monday (0) to Sunday (6).
+    """
+    numpy = library('numpy', required=False)
+    if numpy is None:
+        mask = [True] * len(grid)
+        for zone in zones:
+            local = zone_table(zone).convert(grid)[0]
+            mask = [ok and hours[0] <= instant % 86400 < hours[1] and
+                    (instant // 86400 + 3) % 7 in weekdays
+                    for ok, instant in zip(mask, local)]
+        return mask
+    mask = numpy.ones(len(grid), dtype=bool)
+    allowed = numpy.zeros(7, dtype=bool)
+    allowed[list(weekdays)] = True
+    for zone in zones:
+        local = zone_table(zone).convert(grid)[0]
+        seconds = local % 86400
+        mask &= (seconds >= hours[0]) & (seconds < hours[1]) & allowed[(local // 86400 + 3) % 7]
+    return mask
+
+
+def plan_meetings(zones, start, days, step, hours, weekdays):
+    """Return windows (start, end) where all @zones are within working hours.
+
+    Candidate instants are taken every @step seconds for @days days from
+    @start (seconds since the epoch). Windows are ranked on duration, longest
+    first, and then on start.
+    """
+    grid = list(range(start, start + days * 86400, step))
+    windows = []
+    window_start = None
+    for instant, ok in zip(grid, working_mask(zones, grid, hours, weekdays)):
+        if ok and window_start is None:
+            window_start = instant
+        elif not ok and window_start is not None:
+            windows.append((window_start, instant))
+            window_start = None
+    if window_start is not None:
+        windows.append((window_start, grid[-1] + step))
+    return sorted(windows, key=lambda window: (window[0] - window[1], window[0]))
+
+
+def display_windows(windows, zones, count):
+    """Display the first @count windows with their local times in each zone."""
+    if not windows:
+        print('No overlapping working hours found')
+    for rank, (start, end) in enumerate(windows[:count], 1):
+        minutes = (end - start) // 60
+        print('{0:3}. {1}:{2:02} hours'.format(rank, minutes // 60, minutes % 60))
+        for zone in zones:
+            table = zone_table(zone)
+            print('     {0:20} {1} - {2}'.format(zone, table.strftime(start),
+                                                table.strftime(end).split(' ')[2]))
+
+
 def parse_arguments(banner):
     """Parse and return command line arguments."""
     parser = argparse.ArgumentParser(
@@ -81,10 +482,37 @@ the Free Software Foundation, either version 3 of the License, or
                         help='Timezone of the current or specified time')
     parser.add_argument('--to', action='store',
                         help='Timezone to convert to')
+    parser.add_argument('--convert', action='store', metavar='FILE',
+                        help='Convert all instants (ISO 8601 or seconds since the epoch, '
+                        'one per line) from FILE (- for stdin)')
+    parser.add_argument('--zones', action='store',
+                        help='Comma separated timezones to convert to (default the '
+                        'default timezones)')
+    parser.add_argument('--format', action='store', choices=['csv', 'jsonl'],
+                        default='csv', help='Output format of conversions (default %(default)s)')
+    parser.add_argument('--output', action='store', default='-',
+                        help='Output file of conversions (default stdout)')
+    parser.add_argument('--plan', action='store', type=positive_int, metavar='DAYS',
+                        help='Find overlapping working hours of --zones during DAYS days, '
+                        'starting at the specified (or current) date and time')
+    parser.add_argument('--hours', action='store', type=parse_hours, default='09:00-17:00',
+                        help='Working hours for --plan (default %(default)s)')
+    parser.add_argument('--step', action='store', type=positive_int, default=15,
+                        help='Resolution in minutes for --plan (default %(default)s)')
+    parser.add_argument('--weekends', action='store_true',
+                        help='Include weekends for --plan')
+    parser.add_argument('--top', action='store', type=int, default=10,
+                        help='Number of windows to show for --plan (default %(default)s)')
+    parser.add_argument('--live', action='store_true',
+                        help='Keep displaying the current times, updating every --interval')
+    parser.add_argument('--interval', action='store', type=positive_int, default=60,
+                        help='Update interval in seconds for --live (default %(default)s)')
     parser.add_argument('--list', action='store_true',
                         help='List all timezones')
     parser.add_argument('--country', action='store',
                         help='List all timezones from country [in ISO 3166]')
+    parser.add_argument('--build-index', action='store_true',
+                        help='Rebuild the precompiled timezone index from pytz')
     return vars(parser.parse_args())
 
 
@@ -108,27 +536,24 @@ def set_datetime(from_time, from_date, from_timezone):
 def sort_times(timezones, from_datetime, additional_zones):
     """Add additional zones, and create a list of sorted times according to timezone."""
     for zone in additional_zones:
-        if unicode(zone) not in timezones:
-            timezones.append(unicode(zone))
-    sorted_times = [(item, from_datetime.astimezone(pytz.timezone(item)).
-                     strftime('%z %Y-%m-%d %H:%M %Z')) for item in timezones]
+        zone = unicode(zone)
+        if zone not in timezones:
+            timezones.append(zone)
+    epoch = epoch_seconds(from_datetime)
+    sorted_times = [(item, zone_table(item).strftime(epoch)) for item in timezones]
     sorted(sorted_times, key=lambda x: int(x[1].split()[0]))
     return sorted_times
 
 
 def validate_timezones(from_timezone, to_timezone):
-    """Validate timezones."""
+    """Validate timezones, and return them as pytz timezones."""
     try:
-        if not from_timezone:
-            from_timezone = tzlocal.get_localzone()
-        else:
-            from_timezone = pytz.timezone(from_timezone.title())
-        if not to_timezone:
-            to_timezone = tzlocal.get_localzone()
-        else:
-            to_timezone = pytz.timezone(to_timezone.title())
-    except pytz.exceptions.UnknownTimeZoneError as exception:
-        print('Unknown timezone: {0}'.format(exception))
+        if not from_timezone or not to_timezone:
+            local_timezone = unicode(library('tzlocal').get_localzone())
+        from_timezone = get_timezone(from_timezone or local_timezone)
+        to_timezone = get_timezone(to_timezone or local_timezone)
+    except ValueError as exception:
+        print(exception)
         sys.exit(-1)
     return from_timezone, to_timezone
 
@@ -137,13 +562,49 @@ def main():
     """Main program loop."""
     banner = 'worldtimes version {0}'.format(VERSION)
     options = parse_arguments(banner)
+    if options['build_index']:
+        index = build_zone_index(ZONE_INDEX)
+        print('Saved {0} timezones of pytz {1} to {2}'.format(len(index['zones']),
+                                                             index['pytz'], ZONE_INDEX))
+        sys.exit(0)
     if options['list']:
-        print(' '.join(pytz.all_timezones_set))
+        print(' '.join(load_zone_index()['zones']))
         sys.exit(0)
     if options['country']:
         list_countries(options['country'])
     timezones = DEFAULT_TIMEZONES
     from_timezone, to_timezone = validate_timezones(options['from'], options['to'])
+    try:
+        zones = [resolve_zone(zone) for zone in
+                 (options['zones'].split(',') if options['zones'] else timezones)]
+    except ValueError as exception:
+        print(exception)
+        sys.exit(-1)
+    if options['plan']:
+        start = epoch_seconds(set_datetime(options['time'] or '00:00', options['date'],
+                                           from_timezone))
+        weekdays = range(7) if options['weekends'] else range(5)
+        windows = plan_meetings(zones, start, options['plan'], options['step'] * 60,
+                                options['hours'], weekdays)
+        display_windows(windows, zones, options['top'])
+        sys.exit(0)
+    if options['convert']:
+        source = sys.stdin if options['convert'] == '-' else open(options['convert'])
+        destination = sys.stdout if options['output'] == '-' else open(options['output'], 'w')
+        try:
+            convert_stream(source, destination, zones, from_timezone, options['format'])
+        finally:
+            if source is not sys.stdin:
+                source.close()
+            if destination is not sys.stdout:
+                destination.close()
+        sys.exit(0)
+    if options['live']:
+        for zone in [from_timezone, to_timezone]:
+            if unicode(zone) not in zones:
+                zones.append(unicode(zone))
+        live_times(zones, from_timezone, to_timezone, options['interval'])
+        sys.exit(0)
     from_datetime = set_datetime(options['time'], options['date'], from_timezone)
     sorted_times = sort_times(timezones, from_datetime, [from_timezone, to_timezone])
     display_times(sorted_times, from_timezone, to_timezone)